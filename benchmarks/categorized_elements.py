@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Compare reading categorized elements with a deepcopy of every records
+(former utils._categorized_elements) and with ReadOnlyInfos views copying
+only the returned records (utils.get_categorized_elements_items).
+
+Usage: bin/zopepy benchmarks/categorized_elements.py [elements] [returned]
+"""
+
+from collections import OrderedDict
+from collective.iconifiedcategory.storage import CategorizedElements
+from collective.iconifiedcategory.storage import ReadOnlyInfos
+
+import copy
+import sys
+import timeit
+
+
+def make_infos(idx):
+    return {
+        'title': u'Annex {0}'.format(idx),
+        'description': u'Description of annex {0}'.format(idx),
+        'id': 'annex-{0}'.format(idx),
+        'relative_url': 'folder/annex-{0}'.format(idx),
+        'download_url': u'folder/annex-{0}/@@download'.format(idx),
+        'portal_type': 'File',
+        'filesize': 1024 * idx,
+        'warn_filesize': False,
+        'preview_status': 'converted',
+        'allowedRolesAndUsers': ['Manager', 'Site Administrator', 'Reader', 'user:admin'],
+        'category_uid': 'category-uid-{0}'.format(idx % 10),
+        'category_id': 'category-{0}'.format(idx % 10),
+        'category_title': u'Category {0}'.format(idx % 10),
+        'subcategory_uid': None,
+        'subcategory_id': None,
+        'subcategory_title': None,
+        'icon_url': u'config/category-{0}/@@images/icon'.format(idx % 10),
+        'to_be_printed_activated': True,
+        'confidentiality_activated': True,
+        'signed_activated': False,
+        'publishable_activated': False,
+        'to_print': False,
+        'confidential': False,
+        'to_sign': False,
+        'signed': False,
+        'publishable': False,
+    }
+
+
+def deepcopy_path(storage, returned):
+    elements = copy.deepcopy(
+        OrderedDict([(uid, dict(infos)) for uid, infos in storage.items()]))
+    result = []
+    for uid, infos in elements.items():
+        if len(result) < returned and infos['portal_type'] == 'File':
+            tmp = infos.copy()
+            tmp['UID'] = uid
+            result.append(tmp)
+    return result
+
+
+def read_only_path(storage, returned):
+    result = []
+    for uid, infos in storage.items():
+        infos = ReadOnlyInfos(infos)
+        if len(result) < returned and infos['portal_type'] == 'File':
+            tmp = infos.copy()
+            tmp['UID'] = uid
+            result.append(tmp)
+    return result
+
+
+def main(elements=300, returned=10, number=200):
+    storage = CategorizedElements(
+        [('uid-{0}'.format(idx), make_infos(idx)) for idx in range(elements)])
+    assert deepcopy_path(storage, returned) == read_only_path(storage, returned)
+    print('{0} elements, {1} returned, {2} runs'.format(elements, returned, number))
+    for name, func in (('deepcopy', deepcopy_path), ('read only', read_only_path)):
+        duration = timeit.timeit(lambda: func(storage, returned), number=number)
+        print('{0:>10}: {1:.3f} ms by read'.format(name, duration * 1000 / number))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
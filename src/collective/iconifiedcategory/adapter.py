@@ -7,6 +7,7 @@ Created by mpeeters
 :license: GPL, see LICENCE.txt for more details.
 """
 
+from AccessControl.PermissionRole import rolesForPermissionOn
 from Acquisition import aq_base
 from collective.documentviewer.settings import GlobalSettings
 from collective.documentviewer.settings import Settings
@@ -19,8 +20,11 @@ from plone.app.contenttypes.interfaces import IFile
 from plone.app.contenttypes.interfaces import IImage
 from plone.app.contenttypes.interfaces import ILink
 from plone.indexer.interfaces import IIndexableObject
+from Products.CMFCore.permissions import ModifyPortalContent
 from Products.CMFCore.permissions import View
 from Products.CMFCore.utils import _checkPermission
+from Products.CMFCore.utils import _mergedLocalRoles
+from Products.CMFCore.utils import getToolByName
 from zope.annotation import IAnnotations
 from zope.component import queryMultiAdapter
 
@@ -72,9 +76,12 @@ class CategorizedObjectInfoAdapter(object):
             'download_url': self._download_url,
             'portal_type': self.obj.portal_type,
             'filesize': filesize,
-            'warn_filesize': utils.warn_filesize(filesize),
             'preview_status': self._preview_status,
             'allowedRolesAndUsers': self._allowedRolesAndUsers,
+            'modifyRolesAndUsers': self._modifyRolesAndUsers,
+            'creator': self.obj.Creator(),
+            'created': self.obj.created(),
+            'modified': self.obj.modified(),
         }
         infos.update(base_infos)
         return infos
@@ -151,6 +158,57 @@ class CategorizedObjectInfoAdapter(object):
         wrapper = queryMultiAdapter((self.context, catalog, ), IIndexableObject)
         return wrapper.allowedRolesAndUsers
 
+    @property
+    def _modifyRolesAndUsers(self):
+        """Roles and users having the 'Modify portal content' permission,
+           computed like the allowedRolesAndUsers indexer of Products.CMFPlone
+           does for the 'View' permission"""
+        allowed = set(rolesForPermissionOn(ModifyPortalContent, self.context))
+        if 'Anonymous' in allowed:
+            return ['Anonymous']
+        elif 'Authenticated' in allowed:
+            return ['Authenticated']
+        # local roles given by borg.localrole adapters too
+        try:
+            acl_users = getToolByName(self.context, 'acl_users', None)
+            localroles = acl_users is not None and \
+                acl_users._getAllLocalRoles(self.context) or {}
+        except AttributeError:
+            localroles = _mergedLocalRoles(self.context)
+        for user, roles in localroles.items():
+            if allowed.intersection(roles):
+                allowed.add('user:{0}'.format(user))
+        allowed.discard('Owner')
+        return sorted(allowed)
+
+
+class CategorizedElementsFilterAdapter(object):
+    """Use the stored allowedRolesAndUsers, like a catalog query would do,
+       this is what CategorizedObjectAdapter.can_view checks.
+       Only used when enabled by the 'view_from_stored_security' setting as
+       a customized IIconifiedContent.can_view would be bypassed."""
+
+    @property
+    def use_fast_path(self):
+        return utils.get_settings().view_from_stored_security
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        self._user_tokens = None
+
+    @property
+    def user_tokens(self):
+        if self._user_tokens is None:
+            self._user_tokens = utils.get_current_user_tokens()
+        return self._user_tokens
+
+    def can_view(self, uid, infos):
+        allowed = infos.get('allowedRolesAndUsers')
+        if allowed is None:
+            return
+        return not self.user_tokens.isdisjoint(allowed)
+
 
 class CategorizedObjectPrintableAdapter(object):
 
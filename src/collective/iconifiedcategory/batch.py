@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Batched updates of categorized elements.
+
+While a batch is active, updated elements are collected by container and
+updated when the batch is flushed: informations are computed once by element
+and elements are sorted once by container.
+
+    with batched_updates():
+        for data in annexes:
+            api.content.create(container=item, **data)
+
+or, when the batch must last until the transaction is committed:
+
+    batch_until_commit()
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from Acquisition import aq_base
+from collections import OrderedDict
+from collective.iconifiedcategory import logger
+from collective.iconifiedcategory import stats
+from contextlib import contextmanager
+
+import threading
+import transaction
+
+
+_local = threading.local()
+
+
+class UpdatesBatch(object):
+    """Categorized elements to update by container"""
+
+    def __init__(self):
+        self.active = True
+        # container path -> container, elements to update, sort
+        self._containers = OrderedDict()
+
+    def _container(self, container):
+        path = container.getPhysicalPath()
+        if path not in self._containers:
+            self._containers[path] = {
+                'container': container,
+                'elements': OrderedDict(),
+                'sort': False,
+                'update_all': False,
+            }
+        return self._containers[path]
+
+    def add(self, container, obj, category, limited=False, sort=True, logging=False):
+        """Element p_obj of p_container will be updated, the update is
+           logged when flushed if p_logging"""
+        data = self._container(container)
+        uid = obj.UID()
+        previous = data['elements'].get(uid)
+        if previous is not None:
+            # a complete update is kept
+            limited = limited and previous[2]
+            logging = logging or previous[3]
+        data['elements'][uid] = (obj, category, limited, logging)
+        data['sort'] = data['sort'] or sort
+
+    def add_container(self, container, sort=True):
+        """Every elements of p_container will be updated"""
+        data = self._container(container)
+        data['update_all'] = True
+        data['sort'] = data['sort'] or sort
+
+    def discard(self, container, uid):
+        """Element p_uid of p_container was removed"""
+        data = self._containers.get(container.getPhysicalPath())
+        if data is not None:
+            data['elements'].pop(uid, None)
+
+    def __len__(self):
+        return len(self._containers)
+
+    def flush(self):
+        """Update collected elements, this ends the batch"""
+        from collective.iconifiedcategory import utils
+        self.active = False
+        if getattr(_local, 'batch', None) is self:
+            _local.batch = None
+        containers, self._containers = self._containers, OrderedDict()
+        for data in containers.values():
+            container = data['container']
+            if data['update_all']:
+                utils.update_all_categorized_elements(container, sort=data['sort'])
+                continue
+            storage = utils.get_categorized_elements_storage(container)
+            version = utils._categories_version(container)
+            # changed elements are stored at their position if elements are sorted
+            sort_key = None
+            if data['sort'] and data['elements'] and storage.is_sorted(version):
+                sort_key = utils._element_sort_key(container)
+            for uid, (obj, category, limited, logging) in data['elements'].items():
+                if getattr(aq_base(container), obj.getId(), None) is not aq_base(obj):
+                    # moved meanwhile
+                    continue
+                new_infos = utils.get_categorized_infos(obj, category, limited=limited)[1]
+                utils._store_infos(storage, uid, new_infos, sort_key=sort_key)
+                if logging:
+                    logger.info('Updated categorized elements of {0}'.format(
+                        obj.absolute_url_path()))
+            if data['sort'] and data['elements'] and not storage.is_sorted(version):
+                utils.sort_categorized_elements(container)
+            stats.increment('batched_elements_updated', len(data['elements']))
+        logger.debug('Flushed categorized elements updates of {0} containers'.format(
+            len(containers)))
+
+
+def get_batch():
+    """Return the active UpdatesBatch of current transaction or None"""
+    batch = getattr(_local, 'batch', None)
+    if batch is None or not batch.active:
+        return
+    if _local.transaction is not transaction.get():
+        # transaction ended without flushing the batch (aborted)
+        _local.batch = None
+        return
+    return batch
+
+
+def start_batch():
+    """Start a batch for current transaction, it has to be flushed"""
+    batch = get_batch()
+    if batch is None:
+        batch = _local.batch = UpdatesBatch()
+        _local.transaction = transaction.get()
+    return batch
+
+
+def stop_batch():
+    """Stop the active batch without updating collected elements"""
+    batch = get_batch()
+    if batch is not None:
+        batch.active = False
+    _local.batch = None
+
+
+@contextmanager
+def batched_updates():
+    """Collect categorized elements updates done in the block and update
+       them when leaving it.  Nested blocks are part of the outer batch."""
+    batch = get_batch()
+    if batch is not None:
+        yield batch
+        return
+    batch = start_batch()
+    try:
+        yield batch
+    except Exception:
+        stop_batch()
+        raise
+    batch.flush()
+
+
+def batch_until_commit():
+    """Collect categorized elements updates until current transaction
+       is committed, they are updated by a before commit hook"""
+    batch = get_batch()
+    if batch is None:
+        batch = start_batch()
+        transaction.get().addBeforeCommitHook(_flush_batch, (batch, ))
+    return batch
+
+
+def _flush_batch(batch):
+    if batch.active:
+        batch.flush()
@@ -7,12 +7,16 @@ Created by mpeeters
 :license: GPL, see LICENCE.txt for more details.
 """
 
+from collective.iconifiedcategory import _
+from collective.iconifiedcategory import jobs
 from collective.iconifiedcategory import utils
 from collective.iconifiedcategory.content.category import ICategory
 from collective.iconifiedcategory.event import IconifiedCategoryChangedEvent
 from collective.iconifiedcategory.event import CategorizedElementsUpdatedEvent
 from plone import api
 from Products.Five import BrowserView
+from z3c.json.interfaces import IJSONWriter
+from zope.component import getUtility
 from zope.event import notify
 from zope.i18n import translate
 
@@ -21,24 +25,47 @@ class UpdateCategorizedElementsBase(BrowserView):
 
     def __init__(self, context, request):
         super(UpdateCategorizedElementsBase, self).__init__(context, request)
-        self._notified = []
+        self._notified = set()
         self.sort = self.request.get(
             'sort_updated_categorized_elements', False) is True or False
 
+    def _elements_up_to_date(self):
+        # normalized categorized elements get the category informations
+        # from the configuration, only sorting needs to update them
+        return utils.use_normalized_records() and not self.sort
+
     def _notify(self, brain):
         if brain.UID in self._notified:
             return
-        self._notified.append(brain.UID)
+        self._notified.add(brain.UID)
         event = IconifiedCategoryChangedEvent(brain.getObject(), self.context, sort=self.sort)
         notify(event)
 
-    def notify_category_updated(self, obj):
+    def _category_brains(self, obj):
         brains = [b for b in utils.get_back_references(obj)]
         if ICategory.providedBy(obj):
             for subcategory in obj.listFolderContents():
                 brains.extend(utils.get_back_references(subcategory))
+        return brains
+
+    def notify_category_updated(self, obj):
+        for b in self._category_brains(obj):
+            self._notify(b)
+
+    def update_categories(self, categories):
+        """Update elements using p_categories, by a job if there are
+           more elements than the jobs threshold"""
+        brains = []
+        for category in categories:
+            brains.extend(self._category_brains(category))
+        threshold = jobs.get_jobs_threshold()
+        if threshold and len(set([b.UID for b in brains])) > threshold:
+            job = jobs.add_job(
+                self.context, [b.getPath() for b in brains], sort=self.sort)
+            return self._queued(job)
         for b in brains:
             self._notify(b)
+        self._finished()
 
     def _finished(self):
         msg = translate('Elements updated!',
@@ -48,21 +75,38 @@ class UpdateCategorizedElementsBase(BrowserView):
         api.portal.show_message(msg, request=self.request)
         self.request.RESPONSE.redirect(self.context.absolute_url())
 
+    def _queued(self, job):
+        msg = translate(_('Update of ${count} elements queued.',
+                          mapping={'count': job.total}),
+                        context=self.request)
+        api.portal.show_message(msg, request=self.request)
+        self.request.RESPONSE.redirect(
+            '{0}/@@categorized-elements-jobs'.format(api.portal.get().absolute_url()))
+
 
 class UpdateCategorizedElementsConfig(UpdateCategorizedElementsBase):
 
     def index(self):
+        if self._elements_up_to_date():
+            return self._finished()
         brains = api.content.find(
             context=self.context,
             content_type='ContentCategory',
         )
-        for b in brains:
-            self.notify_category_updated(b.getObject())
-        self._finished()
+        self.update_categories([b.getObject() for b in brains])
 
 
 class UpdateCategorizedElementsCategory(UpdateCategorizedElementsBase):
 
     def index(self):
-        self.notify_category_updated(self.context)
-        self._finished()
+        if self._elements_up_to_date():
+            return self._finished()
+        self.update_categories([self.context])
+
+
+class CategoriesUsageView(BrowserView):
+    """Number of elements using every category and subcategory, by UID"""
+
+    def __call__(self):
+        self.request.response.setHeader('content-type', 'application/json')
+        return getUtility(IJSONWriter).write(utils.get_categories_usage(self.context))
@@ -9,23 +9,248 @@ Created by mpeeters
 
 from Products.Five import BrowserView
 
+from collective.iconifiedcategory import stats
 from collective.iconifiedcategory import utils
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+from io import BytesIO
+from PIL import Image
+from plone.app.imaging.utils import getAllowedSizes
 
+import base64
+import hashlib
+import threading
 
-class IconifiedCategory(BrowserView):
+
+CSS = (u".{0} {{ padding-left: 1.4em; background: "
+       u"transparent url('{1}') no-repeat top left; "
+       u"background-size: contain; }}")
+
+SPRITE_CSS = (u".{0} {{ padding-left: 1.4em; background: "
+              u"transparent url('{1}') no-repeat 0 -{2}px; }}")
+
+SPRITE_VIEW = '@@collective-iconifiedcategory-sprite.png'
+
+# scale of the icons, see utils.store_icon_scale
+ICON_SCALE = 'listing'
+# size of the 'listing' scale when not found in the imaging settings
+DEFAULT_ICON_SIZE = (16, 16)
+
+# icons bigger than this (in bytes) are not embedded as data URI
+DATA_URI_MAX_SIZE = 4096
+
+# one year, only used when the fingerprint is given in the URL
+MAX_AGE = 31536000
+
+_lock = threading.Lock()
+# (name, config group path, base url) -> (snapshot key, result)
+_generated = {}
+
+
+def clear_cache():
+    with _lock:
+        _generated.clear()
+
+
+def _last_modified(context):
+    """Last modification time of the config root of p_context, every change
+       of the categories configuration bumps the version stored on it.
+       None if the config root was not committed yet."""
+    mtime = getattr(utils.query_config_root(context), '_p_mtime', None)
+    return mtime is not None and int(mtime) or None
+
+
+def _fingerprinted(data, last_modified):
+    """Return (data, etag, last modified) for p_data"""
+    encoded = isinstance(data, unicode) and data.encode('utf-8') or data
+    return data, hashlib.md5(encoded).hexdigest(), last_modified
+
+
+def _cached(name, config_group, snapshot, build):
+    """Return build(), computed once by version of the categories
+       configuration for p_config_group"""
+    key = snapshot is not None and snapshot.key or None
+    cache_key = (name, config_group.getPhysicalPath(), config_group.absolute_url())
+    cached = _generated.get(cache_key)
+    if key is not None and cached is not None and cached[0] == key:
+        stats.increment('css_cache_hits')
+        return cached[1]
+    result = build()
+    # a private snapshot (configuration modified in current transaction)
+    # has no key and is not cached
+    if key is not None:
+        with _lock:
+            _generated[cache_key] = (key, result)
+    return result
+
+
+def get_icon_size():
+    """Return the (width, height) of the ICON_SCALE scale configured in the
+       imaging settings"""
+    return (getAllowedSizes() or {}).get(ICON_SCALE, DEFAULT_ICON_SIZE)
+
+
+def _scaled_icon(category, size):
+    """Return the icon of p_category scaled to p_size as a PIL image,
+       None if the icon is not an image PIL can read (like SVG)"""
+    icon = getattr(category, 'icon', None)
+    if icon is None:
+        return
+    try:
+        image = Image.open(BytesIO(icon.data))
+        image = image.convert('RGBA')
+    except (IOError, ValueError):
+        return
+    image.thumbnail(size, Image.ANTIALIAS)
+    return image
+
+
+def _png(image):
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def get_sprite(context):
+    """Return (png data, etag, last modified, positions) of the sprite
+       packing icons of every enabled category of the config root of
+       p_context, positions is a dict {calculated id: y offset}"""
+    config_root = utils.query_config_root(context)
+    snapshot = utils.get_categories_snapshot(context)
+    size = get_icon_size()
+
+    def build():
+        icons = []
+        for infos in snapshot.categories():
+            icon = _scaled_icon(config_root.unrestrictedTraverse('/'.join(infos.path)), size)
+            if icon is not None:
+                icons.append((infos.calculated_id, icon))
+        width, height = size
+        sprite = Image.new('RGBA', (width, max(len(icons), 1) * height), (0, 0, 0, 0))
+        positions = {}
+        for idx, (category_id, icon) in enumerate(icons):
+            sprite.paste(icon, (0, idx * height))
+            positions[category_id] = idx * height
+        return _fingerprinted(_png(sprite), _last_modified(context)) + (positions, )
+
+    return _cached('sprite-{0}x{1}'.format(*size), config_root, snapshot, build)
+
+
+def _url_rule(category):
+    return CSS.format(utils.format_id_css(utils.calculate_category_id(category)),
+                      u'{0}/@@download'.format(category.absolute_url()))
+
+
+def _sprite_rules(context, categories):
+    data, etag, last_modified, positions = get_sprite(context)
+    url = u'{0}/{1}?v={2}'.format(
+        utils.query_config_root(context).absolute_url(), SPRITE_VIEW, etag)
+    rules = []
+    for category in categories:
+        category_id = utils.calculate_category_id(category)
+        if category_id in positions:
+            rules.append(SPRITE_CSS.format(
+                utils.format_id_css(category_id), url, positions[category_id]))
+        else:
+            rules.append(_url_rule(category))
+    return rules
+
+
+def _data_uri_rule(category, size):
+    image = _scaled_icon(category, size)
+    icon = getattr(category, 'icon', None)
+    if image is not None:
+        data, content_type = _png(image), 'image/png'
+    elif icon is not None:
+        data, content_type = icon.data, icon.contentType
+    if icon is None or len(data) > DATA_URI_MAX_SIZE:
+        return _url_rule(category)
+    return CSS.format(
+        utils.format_id_css(utils.calculate_category_id(category)),
+        u'data:{0};base64,{1}'.format(content_type, base64.b64encode(data)))
+
+
+def get_css(context):
+    """Return (css, etag, last modified) for p_context, the stylesheet is
+       generated once by version of the categories configuration.
+       Icons are rendered following the 'css_icons_mode' setting."""
+    mode = utils.get_settings().css_icons_mode
+    size = get_icon_size()
+    config_group, snapshot, group_path = utils._group_path(context)
+    if group_path is None:
+        # config group not found in the snapshot, not cached
+        snapshot = None
+
+    def build():
+        categories = utils.get_categories(context, the_objects=True)
+        if mode == 'sprite':
+            rules = _sprite_rules(context, categories)
+        elif mode == 'data-uri':
+            rules = [_data_uri_rule(category, size) for category in categories]
+        else:
+            rules = [_url_rule(category) for category in categories]
+        return _fingerprinted(' '.join(rules), _last_modified(context))
+
+    # icons of the sprite and data URIs are scaled to the 'listing' size
+    name = 'css-{0}-{1}x{2}'.format(mode, *size)
+    return _cached(name, config_group, snapshot, build)
+
+
+class CachedResourceView(BrowserView):
+    """Serve a resource with an ETag and a Last-Modified header,
+       conditional requests get a 304"""
+
+    content_type = 'text/css'
+
+    def get_resource(self):
+        """Return (data, etag, last modified), the categories stylesheet
+           of the context by default"""
+        return get_css(self.context)
 
     def __call__(self, *args, **kwargs):
-        self.request.response.setHeader('Content-Type', 'text/css')
-        content = []
-        css = (u".{0} {{ padding-left: 1.4em; background: "
-               u"transparent url('{1}') no-repeat top left; "
-               u"background-size: contain; }}")
+        response = self.request.response
+        response.setHeader('Content-Type', self.content_type)
         if utils.has_config_root(self.context) is False:
             return ''
-        categories = utils.get_categories(self.context)
-        for category in categories:
-            obj = category._unrestrictedGetObject()
-            category_id = utils.calculate_category_id(obj)
-            url = u'{0}/@@download'.format(obj.absolute_url())
-            content.append(css.format(utils.format_id_css(category_id), url))
-        return ' '.join(content)
+        data, etag, last_modified = self.get_resource()[:3]
+        response.setHeader('ETag', '"{0}"'.format(etag))
+        if last_modified is not None:
+            response.setHeader('Last-Modified', formatdate(last_modified, usegmt=True))
+        if self.request.form.get('v') == etag:
+            # fingerprinted URL, content never changes
+            response.setHeader('Cache-Control', 'public, max-age={0}'.format(MAX_AGE))
+        else:
+            response.setHeader('Cache-Control', 'public, max-age=0, must-revalidate')
+        if self._not_modified(etag, last_modified):
+            response.setStatus(304)
+            return ''
+        return data
+
+    def _not_modified(self, etag, last_modified):
+        if_none_match = self.request.getHeader('If-None-Match')
+        if if_none_match:
+            etags = [value.strip() for value in if_none_match.split(',')]
+            return '"{0}"'.format(etag) in etags or '*' in etags
+        if_modified_since = self.request.getHeader('If-Modified-Since')
+        if if_modified_since and last_modified is not None:
+            parsed = parsedate_tz(if_modified_since.split(';')[0])
+            return parsed is not None and last_modified <= mktime_tz(parsed)
+        return False
+
+
+class IconifiedCategory(CachedResourceView):
+
+    def fingerprinted_url(self):
+        """URL of the stylesheet that may be cached forever"""
+        etag = get_css(self.context)[1]
+        return '{0}/@@collective-iconifiedcategory.css?v={1}'.format(
+            self.context.absolute_url(), etag)
+
+
+class IconifiedCategorySprite(CachedResourceView):
+
+    content_type = 'image/png'
+
+    def get_resource(self):
+        return get_sprite(self.context)
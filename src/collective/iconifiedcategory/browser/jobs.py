@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Views following and processing the jobs updating categorized elements.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from collective.iconifiedcategory import jobs
+from plone import api
+from plone.protect import CheckAuthenticator
+from Products.Five import BrowserView
+
+
+class CategorizedElementsJobsView(BrowserView):
+    """Status of the jobs, they may be cancelled, resumed or purged"""
+
+    def __call__(self):
+        form = self.request.form
+        action = [name for name in ('cancel', 'resume', 'purge') if name in form]
+        if action and self.request.get('REQUEST_METHOD') == 'POST':
+            CheckAuthenticator(self.request)
+            self.apply(action[0], form.get('job_id'))
+            return self.request.RESPONSE.redirect(
+                '{0}/@@categorized-elements-jobs'.format(self.context.absolute_url()))
+        return self.index()
+
+    def apply(self, action, job_id=None):
+        queue = jobs.get_jobs_queue(self.context)
+        if action == 'purge':
+            return queue.purge()
+        job = job_id and queue.get(int(job_id))
+        if job:
+            getattr(job, action)()
+
+    def jobs(self):
+        queue = jobs.get_jobs_queue(self.context, create=False)
+        return queue is not None and list(queue) or []
+
+    def progress(self, job):
+        return job.total and job.position * 100 / job.total or 100
+
+
+class ProcessCategorizedElementsJobsView(BrowserView):
+    """Process pending jobs, to call from a clockserver, every chunk
+       of elements is committed in its own transaction"""
+
+    def __call__(self, chunks=None):
+        chunks = chunks or self.request.get('chunks')
+        chunk_size = int(self.request.get('chunk_size', 500))
+        processed = jobs.process_jobs(
+            api.portal.get(),
+            chunk_size=chunk_size,
+            max_chunks=chunks and int(chunks) or None,
+        )
+        return '{0} chunks processed'.format(processed)
@@ -9,12 +9,13 @@ Created by mpeeters
 
 from collective.iconifiedcategory import _
 from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.browser.actionview import BaseView
 from collective.iconifiedcategory.interfaces import ICategorizedConfidential
 from collective.iconifiedcategory.interfaces import ICategorizedPrint
 from collective.iconifiedcategory.interfaces import ICategorizedPublishable
 from collective.iconifiedcategory.interfaces import ICategorizedSigned
 from collective.iconifiedcategory.interfaces import ICategorizedTable
-from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from collective.iconifiedcategory.snapshot import GROUP_FLAGS
 from plone import api
 from Products.CMFCore.permissions import ModifyPortalContent
 from Products.CMFCore.utils import _checkPermission
@@ -70,7 +71,7 @@ class CategorizedContent(object):
     def __init__(self, context, content):
         self.context = context
         self.UID = content['UID']
-        self._metadata = context.categorized_elements.get(content['UID'], {})
+        self._metadata = content
 
     def __getattr__(self, key):
         if key in self._metadata:
@@ -84,13 +85,19 @@ class CategorizedContent(object):
             self.obj = obj
         return obj
 
+    def _stored(self, key, method_name):
+        # elements stored before these informations were added
+        if key in self._metadata:
+            return self._metadata[key]
+        return getattr(self.getObject(), method_name)()
+
     @property
     def Description(self):
-        return self.getObject().Description()
+        return self._stored('description', 'Description')
 
     @property
     def Creator(self):
-        return self.getObject().Creator()
+        return self._stored('creator', 'Creator')
 
     @property
     def CreationDate(self):
@@ -98,7 +105,7 @@ class CategorizedContent(object):
 
     @property
     def created(self):
-        return self.getObject().created()
+        return self._stored('created', 'created')
 
     @property
     def ModificationDate(self):
@@ -106,7 +113,16 @@ class CategorizedContent(object):
 
     @property
     def modified(self):
-        return self.getObject().modified()
+        return self._stored('modified', 'modified')
+
+    def can_modify(self):
+        """May the current user modify the element?  Computed from the stored
+           modifyRolesAndUsers if the 'view_from_stored_security' setting is
+           enabled"""
+        allowed = self._metadata.get('modifyRolesAndUsers')
+        if allowed is None or not utils.get_settings().view_from_stored_security:
+            return bool(_checkPermission(ModifyPortalContent, self.getObject()))
+        return not utils.get_current_user_tokens().isdisjoint(allowed)
 
     def getPath(self):
         portal_path = '/'.join(api.portal.get().getPhysicalPath())
@@ -129,6 +145,9 @@ class CategorizedTable(Table):
     cssClassOdd = u'even'
     # do not sort, keep order of position in parent
     sortOn = None
+    # IconClickableColumn.is_editable uses the table precomputed informations
+    # when the action view does not override _may_set_values
+    precompute_editable = True
     batchSize = 999
     startBatchingAt = 999
 
@@ -137,16 +156,16 @@ class CategorizedTable(Table):
         self.portal_type = portal_type
         super(CategorizedTable, self).__init__(context, request)
         self.portal = api.portal.get()
+        # informations computed once for the whole table, see is_editable
+        self._category_flags = {}
+        self._may_modify = {}
+        self._base_may_set_values = {}
 
     @property
     def values(self):
         if not getattr(self, '_v_stored_values', []):
             sort_on = 'getObjPositionInParent'
-            sort_categorized_tab = api.portal.get_registry_record(
-                'sort_categorized_tab',
-                interface=IIconifiedCategorySettings,
-            )
-            if sort_categorized_tab is True:
+            if utils.get_settings().sort_categorized_tab is True:
                 sort_on = None
             data = [
                 CategorizedContent(self.context, content) for content in
@@ -160,6 +179,54 @@ class CategorizedTable(Table):
             self._v_stored_values = data
         return self._v_stored_values
 
+    def update(self):
+        self._category_flags = {}
+        self._may_modify = {}
+        self._base_may_set_values = {}
+        super(CategorizedTable, self).update()
+
+    def _get_category_flags(self, content):
+        """Group flags (to_be_printed_activated, ...) of the category of
+           p_content, resolved once by category"""
+        uid = content._metadata.get('subcategory_uid') or content._metadata['category_uid']
+        if uid not in self._category_flags:
+            snapshot = utils.get_categories_snapshot(self.context)
+            infos = snapshot is not None and snapshot.get(uid) or None
+            # category not found in the configuration, use stored values
+            infos = infos is not None and infos.basic_infos or content._metadata
+            self._category_flags[uid] = dict(
+                [(name, infos.get(name, True)) for name in GROUP_FLAGS])
+        return self._category_flags[uid]
+
+    def _get_may_modify(self, content):
+        """May current user modify p_content?  Like BaseView._may_set_values
+           unless the 'view_from_stored_security' setting is enabled, then it
+           is computed once by distinct roles and users having the permission"""
+        allowed = content._metadata.get('modifyRolesAndUsers')
+        if allowed is None or not utils.get_settings().view_from_stored_security:
+            return bool(api.user.has_permission(ModifyPortalContent, obj=content.getObject()))
+        key = frozenset(allowed)
+        if key not in self._may_modify:
+            self._may_modify[key] = content.can_modify()
+        return self._may_modify[key]
+
+    def uses_base_may_set_values(self, action_view):
+        """Is p_action_view using BaseView._may_set_values?  The view is
+           looked up on the context so elements are not loaded, action views
+           are customized by browser layer.  Computed once by action view"""
+        if action_view not in self._base_may_set_values:
+            view = getMultiAdapter((self.context, self.request), name=action_view)
+            may_set_values = getattr(type(view), '_may_set_values', None)
+            self._base_may_set_values[action_view] = (
+                getattr(may_set_values, '__func__', None) is BaseView._may_set_values.__func__)
+        return self._base_may_set_values[action_view]
+
+    def is_editable(self, content, category_group_attr_name):
+        """Same as the action view _may_set_values, without loading p_content.
+           Only valid if the action view uses BaseView._may_set_values"""
+        return bool(self._get_category_flags(content)[category_group_attr_name] and
+                    self._get_may_modify(content))
+
     def render(self):
         if not len(self.rows):
             return _(
@@ -251,6 +318,8 @@ class FilesizeColumn(column.GetAttrColumn):
 
 class IconClickableColumn(column.GetAttrColumn):
     action_view = ''
+    # the group flag enabling the action, like in the action view
+    category_group_attr_name = ''
 
     def _deactivated_is_useable(self):
         '''Is deactivated value a useable one?'''
@@ -274,6 +343,9 @@ class IconClickableColumn(column.GetAttrColumn):
         return getattr(content, self.attrName, False) is None
 
     def is_editable(self, content):
+        if getattr(self.table, 'precompute_editable', False) and \
+           self.table.uses_base_may_set_values(self.action_view):
+            return self.table.is_editable(content, self.category_group_attr_name)
         view = getMultiAdapter((content.getObject(), self.request), name=self.action_view)
         return view._may_set_values({})
 
@@ -307,6 +379,7 @@ class PrintColumn(IconClickableColumn):
     weight = 80
     attrName = 'to_print'
     action_view = 'iconified-print'
+    category_group_attr_name = 'to_be_printed_activated'
 
     def alt(self, content):
         return translate(
@@ -322,6 +395,7 @@ class ConfidentialColumn(IconClickableColumn):
     weight = 90
     attrName = 'confidential'
     action_view = 'iconified-confidential'
+    category_group_attr_name = 'confidentiality_activated'
 
     def alt(self, content):
         return translate(
@@ -337,6 +411,7 @@ class SignedColumn(IconClickableColumn):
     weight = 95
     attrName = 'signed'
     action_view = 'iconified-signed'
+    category_group_attr_name = 'signed_activated'
 
     def alt(self, content):
         return translate(
@@ -359,6 +434,7 @@ class PublishableColumn(IconClickableColumn):
     weight = 98
     attrName = 'publishable'
     action_view = 'iconified-publishable'
+    category_group_attr_name = 'publishable_activated'
 
     def alt(self, content):
         return translate(
@@ -375,7 +451,7 @@ class ActionColumn(column.GetAttrColumn):
     def renderCell(self, content):
         link = u'<a href="{href}"><img src="{src}" title="{title}" /></a>'
         render = []
-        if _checkPermission(ModifyPortalContent, content):
+        if content.can_modify():
             render.append(link.format(
                 href=u'{0}/edit'.format(content.getURL()),
                 src=u'{0}/edit.gif'.format(content.getURL()),
@@ -7,8 +7,26 @@ Created by mpeeters
 :license: GPL, see LICENCE.txt for more details.
 """
 
+from collective.iconifiedcategory import utils
 from plone.app.layout.viewlets import common as base
+from zope.component import getMultiAdapter
+
+
+LINK = u'<link rel="stylesheet" type="text/css" media="screen" href="{0}" />'
 
 
 class CategorizedChildViewlet(base.ViewletBase):
     """ """
+
+
+class CategoriesStylesheetViewlet(base.ViewletBase):
+    """Link to the categories stylesheet of the portal, the URL changes with
+       the stylesheet so browsers may cache it forever"""
+
+    def render(self):
+        portal = self.portal_state.portal()
+        if not utils.has_config_root(portal):
+            return u''
+        view = getMultiAdapter(
+            (portal, self.request), name='collective-iconifiedcategory.css')
+        return LINK.format(view.fingerprinted_url())
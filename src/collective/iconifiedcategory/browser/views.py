@@ -4,12 +4,13 @@ from AccessControl import Unauthorized
 from Acquisition import aq_base
 from Acquisition import aq_inner
 from collections import OrderedDict
-from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
 from collective.iconifiedcategory.interfaces import IIconifiedContent
 from collective.iconifiedcategory.utils import boolean_message
 from collective.iconifiedcategory.utils import get_categorized_elements
+from collective.iconifiedcategory.utils import get_settings
 from collective.iconifiedcategory.utils import print_message
 from collective.iconifiedcategory.utils import render_filesize
+from collective.iconifiedcategory.utils import search_categorized_elements
 from collective.iconifiedcategory.utils import signed_message
 from DateTime import DateTime
 from plone import api
@@ -50,16 +51,15 @@ class CategorizedChildView(BrowserView):
                 len(self.categorized_elements) > 0)
 
     def categories_infos(self):
-        infos = [(e['category_uid'], {'id': e['category_id'],
-                                      'uid': e['category_uid'],
-                                      'title': e['category_title'],
-                                      'counts': 0,
-                                      'icon': e['icon_url']})
-                 for e in self.categorized_elements]
-        infos = OrderedDict(infos)
-        for key, element in infos.items():
-            element['counts'] = len([e for e in self.categorized_elements
-                                     if e['category_uid'] == key])
+        infos = OrderedDict()
+        for e in self.categorized_elements:
+            if e['category_uid'] not in infos:
+                infos[e['category_uid']] = {'id': e['category_id'],
+                                            'uid': e['category_uid'],
+                                            'title': e['category_title'],
+                                            'counts': 0,
+                                            'icon': e['icon_url']}
+            infos[e['category_uid']]['counts'] += 1
         return infos.values()
 
 
@@ -78,11 +78,7 @@ class CategorizedChildInfosView(BrowserView):
 
     def _find_uids(self):
         """ """
-        uids = []
-        for k, v in getattr(self.context, 'categorized_elements', {}).items():
-            if v['category_uid'] == self.category_uid:
-                uids.append(k)
-        return uids
+        return list(search_categorized_elements(self.context, category_uid=self.category_uid))
 
     def __call__(self, category_uid):
         """ """
@@ -125,11 +121,8 @@ class CategorizedChildInfosView(BrowserView):
     def number_of_columns(self, elements):
         """Return number of columns to display categorized_elements on
            when displaying many elements."""
-        columns_treshold = api.portal.get_registry_record(
-            'categorized_childs_infos_columns_threshold',
-            interface=IIconifiedCategorySettings,
-        )
-        columns_treshold = float(columns_treshold)
+        columns_treshold = float(
+            get_settings().categorized_childs_infos_columns_threshold)
         return round(len(elements) / columns_treshold)
 
     def show(self, element, attr_prefix):
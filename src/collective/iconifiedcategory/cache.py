@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Caches living as long as the current request.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+import threading
+import transaction
+
+
+CACHE_KEY = 'collective.iconifiedcategory.cache'
+
+_local = threading.local()
+
+
+def _get_caches():
+    """Return the dict holding every named cache.
+       It is stored in the request annotations or, when there is no request
+       (plone.app.async jobs, zopectl run scripts), it lives as long as the
+       current transaction."""
+    request = getRequest()
+    if request is not None:
+        annotations = IAnnotations(request, None)
+        if annotations is not None:
+            return annotations.setdefault(CACHE_KEY, {})
+    txn = transaction.get()
+    if getattr(_local, 'transaction', None) is not txn:
+        _local.transaction = txn
+        _local.caches = {}
+    return _local.caches
+
+
+def get_cache(name):
+    """Return the request scoped cache (a dict) registered under p_name."""
+    return _get_caches().setdefault(name, {})
+
+
+def invalidate(name):
+    """Empty the request scoped cache registered under p_name."""
+    _get_caches().pop(name, None)
@@ -9,12 +9,74 @@ Created by mpeeters
 
 from collective.iconifiedcategory import _
 from plone.autoform import directives as form
+from plone.uuid.interfaces import IUUID
 from z3c.form.browser.radio import RadioFieldWidget
 from zope import schema
+from zope.component.hooks import getSite
 from zope.interface import Interface
 from zope.interface import Invalid
 from zope.interface import invariant
 
+import threading
+import transaction
+
+
+_local = threading.local()
+
+
+def config_changes():
+    """Number of attributes of configuration objects set in current
+       transaction, see ConfigurationContent"""
+    if getattr(_local, 'transaction', None) is not transaction.get():
+        return 0
+    return _local.changes
+
+
+def _config_changed(obj):
+    txn = transaction.get()
+    if getattr(_local, 'transaction', None) is not txn:
+        _local.transaction = txn
+        _local.changes = 0
+        _local.changed_uids = set()
+        txn.addBeforeCommitHook(_bump_versions, (_local.changed_uids, ))
+    _local.changes += 1
+    uid = IUUID(obj, None)
+    if uid is not None:
+        _local.changed_uids.add(uid)
+
+
+def _bump_versions(uids):
+    """Before commit, bump the version of the config roots of the p_uids
+       configuration objects modified in the transaction, so the snapshots
+       of other threads and ZEO clients are built again even if no event
+       was notified"""
+    site = getSite()
+    catalog = getattr(site, 'portal_catalog', None)
+    if not uids or catalog is None:
+        return
+    # avoid circular import
+    from collective.iconifiedcategory import snapshot
+    for brain in catalog.unrestrictedSearchResults(UID=list(uids)):
+        # events may already have bumped it
+        snapshot.bump_version(brain._unrestrictedGetObject(), once=True)
+
+
+class ConfigurationContent(object):
+    """Mixin of the configuration content types counting changes made in
+       current transaction so the categories snapshot is built again
+       (see snapshot.get_snapshot) and the version of the config root is
+       bumped when committed, even if no event was notified"""
+
+    def __setattr__(self, name, value):
+        if not name.startswith(('_p_', '_v_')):
+            _config_changed(self)
+        super(ConfigurationContent, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if not name.startswith(('_p_', '_v_')):
+            _config_changed(self)
+        super(ConfigurationContent, self).__delattr__(name)
+
 
 class ICategorize(Interface):
 
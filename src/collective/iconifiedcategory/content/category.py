@@ -8,6 +8,7 @@ Created by mpeeters
 """
 
 from collective.iconifiedcategory import _
+from collective.iconifiedcategory.content.base import ConfigurationContent
 from collective.iconifiedcategory.content.base import ICategorize
 from collective.iconifiedcategory.interfaces import IICImageScaleTraversable
 from plone.app.contenttypes.interfaces import IFolder
@@ -33,7 +34,7 @@ class ICategory(IFolder, ICategorize, IICImageScaleTraversable):
 alsoProvides(ICategory['icon'], IPrimaryField)
 
 
-class Category(Container):
+class Category(ConfigurationContent, Container):
     implements(ICategory)
 
     @property
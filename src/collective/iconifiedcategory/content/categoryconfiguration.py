@@ -7,6 +7,7 @@ Created by mpeeters
 :license: GPL, see LICENCE.txt for more details.
 """
 
+from collective.iconifiedcategory.content.base import ConfigurationContent
 from plone.app.contenttypes.interfaces import IFolder
 from plone.dexterity.content import Container
 from zope.interface import implements
@@ -16,5 +17,5 @@ class ICategoryConfiguration(IFolder):
     """Marker interface of ContentCategoryConfiguration"""
 
 
-class CategoryConfiguration(Container):
+class CategoryConfiguration(ConfigurationContent, Container):
     implements(ICategoryConfiguration)
@@ -16,6 +16,7 @@ from zope.interface import implements
 from zope import schema
 
 from collective.iconifiedcategory import _
+from collective.iconifiedcategory.content.base import ConfigurationContent
 
 
 class ICategoryGroup(IFolder):
@@ -49,7 +50,7 @@ class ICategoryGroup(IFolder):
     )
 
 
-class CategoryGroup(Container):
+class CategoryGroup(ConfigurationContent, Container):
     implements(ICategoryGroup)
 
 
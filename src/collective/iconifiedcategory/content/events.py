@@ -8,6 +8,7 @@ Created by mpeeters
 """
 
 from collective.iconifiedcategory import _
+from collective.iconifiedcategory import snapshot
 from collective.iconifiedcategory import utils
 from collective.iconifiedcategory.content.category import ICategory
 from collective.iconifiedcategory.content.subcategory import ISubcategory
@@ -15,10 +16,12 @@ from collective.iconifiedcategory.event import IconifiedAttrChangedEvent
 from collective.iconifiedcategory.interfaces import IIconifiedPrintable
 from plone import api
 from plone.rfc822.interfaces import IPrimaryFieldInfo
+from Products.CMFPlone.utils import base_hasattr
 from Products.statusmessages.interfaces import IStatusMessage
 from zExceptions import Redirect
 from zope.component import getAdapter
 from zope.event import notify
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 
 
 def categorized_content_created(obj, event):
@@ -162,6 +165,16 @@ def categorized_content_removed(event):
         utils.remove_categorized_element(obj.aq_parent, obj)
 
 
+def categorized_content_security_changed(obj, event):
+    # stored allowedRolesAndUsers are used to know if categorized elements
+    # may be viewed, keep it up to date when security changes
+    if base_hasattr(obj, 'content_category'):
+        utils.update_categorized_elements_security(obj.aq_parent, uids=[obj.UID()])
+    if base_hasattr(obj, 'categorized_elements'):
+        # security of contained elements may depend on container
+        utils.update_categorized_elements_security(obj)
+
+
 def categorized_content_container_cloned(event):
     if event.object.REQUEST.get('defer_update_categorized_elements', False):
         return
@@ -179,7 +192,6 @@ def category_before_remove(obj, event):
                 type='error',
             )
             raise Redirect(obj.REQUEST.get('HTTP_REFERER'))
-        _cookCssResources()
 
 
 def subcategory_before_remove(obj, event):
@@ -205,7 +217,6 @@ def category_moved(obj, event):
             type='error',
         )
         raise Redirect(obj.REQUEST.get('HTTP_REFERER'))
-    _cookCssResources()
 
 
 def subcategory_moved(obj, event):
@@ -220,14 +231,25 @@ def subcategory_moved(obj, event):
         raise Redirect(obj.REQUEST.get('HTTP_REFERER'))
 
 
-def _cookCssResources():
-    # recook portal_css because we need
-    # iconified-category.css to be compiled again as it is cached
-    portal_css = api.portal.get_tool('portal_css')
-    portal_css.cookResources()
+def category_configuration_moved(obj, event):
+    # a config root was added, moved or removed, forget config roots
+    # resolved during current request
+    utils.invalidate_config_root_cache()
+
+
+def category_configuration_changed(obj, event):
+    # a group, category or subcategory was added, modified, moved or removed,
+    # bump the config root version so categories snapshots are rebuilt
+    snapshot.bump_version(obj)
+    if IObjectMovedEvent.providedBy(event) and event.oldParent is not None:
+        snapshot.bump_version(event.oldParent)
 
 
 def category_created(category, event):
-    # make sure the 'listing' scale image is created
-    category.restrictedTraverse('@@images').scale(scale='listing')
-    _cookCssResources()
+    # make sure the 'listing' scale image is created and store its name
+    utils.store_icon_scale(category)
+
+
+def category_modified(category, event):
+    # icon may have changed, its 'listing' scale too
+    utils.store_icon_scale(category)
@@ -12,6 +12,7 @@ from plone.dexterity.content import Item
 from plone.dexterity.schema import DexteritySchemaPolicy
 from zope.interface import implements
 
+from collective.iconifiedcategory.content.base import ConfigurationContent
 from collective.iconifiedcategory.content.base import ICategorize
 
 
@@ -19,7 +20,7 @@ class ISubcategory(IFolder, ICategorize):
     pass
 
 
-class Subcategory(Item):
+class Subcategory(ConfigurationContent, Item):
     implements(ISubcategory)
 
     @property
@@ -26,6 +26,19 @@ class IIconifiedContent(Interface):
     pass
 
 
+class IIconifiedContentFilter(Interface):
+    """Adapts a container and the request, decides if categorized elements
+       of the container may be viewed from their stored informations,
+       without loading them."""
+
+    use_fast_path = Attribute(
+        "If False, every element is loaded and IIconifiedContent.can_view is used")
+
+    def can_view(uid, infos):
+        """Return True or False, or None if it can not be decided from
+           p_infos, IIconifiedContent.can_view is then used"""
+
+
 class IIconifiedInfos(Interface):
     pass
 
@@ -90,12 +103,52 @@ class IIconifiedCategorySettings(Interface):
         title=_(u'Filesize limit in bytes enabling a warning'),
         description=_(u'If the categorized element is a file, the user will '
                       u'get a warning whenever the filesize is bigger than '
-                      u'defined value. <span style="color: red">Take care that '
-                      u'if you change this value, you will have to update the '
-                      u'categoized elements stored informations.</span> '),
+                      u'defined value.'),
         default=5000000,
     )
 
+    normalized_categorized_elements = schema.Bool(
+        title=_(u'Store categorized elements informations normalized'),
+        description=_(u'Categorized elements only store a reference to their '
+                      u'category, category informations (title, icon, ...) are '
+                      u'taken from the configuration when displayed so editing '
+                      u'a category does not need to update categorized elements.'),
+        default=False,
+    )
+
+    categorized_elements_jobs_threshold = schema.Int(
+        title=_(u'Number of categorized elements above which updating them '
+                u'after a configuration change is done in background'),
+        description=_(u'Elements are then updated by chunks by the '
+                      u'@@process-categorized-elements-jobs view or the '
+                      u'process_jobs script, follow progress in '
+                      u'@@categorized-elements-jobs. 0 to always update '
+                      u'them immediately.'),
+        default=1000,
+        required=False,
+    )
+
+    view_from_stored_security = schema.Bool(
+        title=_(u'Decide if categorized elements may be viewed from their '
+                u'stored security, without loading them'),
+        description=_(u'Only enable it if the IIconifiedContent adapter checks '
+                      u'the View permission, a customized can_view is not '
+                      u'used anymore when enabled.  The categorized tab also '
+                      u'decides if elements may be modified from their stored '
+                      u'security.'),
+        default=False,
+        required=False,
+    )
+
+    css_icons_mode = schema.Choice(
+        title=_(u'How category icons are rendered in the stylesheet'),
+        description=_(u'"url": one request by icon, "sprite": every icon in '
+                      u'one image, "data-uri": small icons are embedded in '
+                      u'the stylesheet.'),
+        values=('url', 'sprite', 'data-uri'),
+        default='url',
+    )
+
 
 # Events
 
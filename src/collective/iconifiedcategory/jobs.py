@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Persistent queue of jobs updating categorized elements.
+
+Updating the categorized elements using a category may concern a huge number
+of elements, a job stores the paths of these elements and updates them by
+chunks, every chunk is committed in its own transaction so a job may be
+interrupted and resumed.  Jobs are stored in the portal annotations and
+processed by `process_jobs`, called by the `@@process-categorized-elements-jobs`
+view (clockserver) or by the `scripts/process_jobs.py` script (zopectl run).
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from BTrees.IOBTree import IOBTree
+from collective.iconifiedcategory import logger
+from collective.iconifiedcategory.batch import batched_updates
+from collective.iconifiedcategory.event import CategorizedElementsUpdatedEvent
+from collective.iconifiedcategory.event import IconifiedCategoryChangedEvent
+from collective.iconifiedcategory.settings import get_settings
+from DateTime import DateTime
+from persistent import Persistent
+from plone import api
+from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
+from zope.event import notify
+
+import transaction
+
+
+JOBS_KEY = 'collective.iconifiedcategory.jobs'
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class UpdateCategorizedElementsJob(Persistent):
+    """Notify IconifiedCategoryChangedEvent for the elements at p_paths,
+       p_category_path is the path of the updated configuration"""
+
+    def __init__(self, id, category_path, paths, sort=False):
+        self.id = id
+        self.category_path = category_path
+        self.sort = sort
+        # paths are written once, updating progress does not write them again
+        self.paths = IOBTree()
+        for idx, path in enumerate(sorted(set(paths))):
+            self.paths[idx] = path
+        self.total = len(self.paths)
+        self.position = 0
+        self.status = PENDING
+        self.created = self.modified = DateTime()
+        self.errors = ()
+
+    def __repr__(self):
+        return '<UpdateCategorizedElementsJob {0} {1} {2}/{3}>'.format(
+            self.id, self.status, self.position, self.total)
+
+    @property
+    def active(self):
+        return self.status in (PENDING, RUNNING)
+
+    def next_chunk(self, size):
+        """Return the paths of the next p_size elements to update"""
+        return list(self.paths.values(self.position, self.position + size - 1))
+
+    def advance(self, count):
+        self.position = min(self.position + count, self.total)
+        self.status = self.position == self.total and FINISHED or RUNNING
+        self.modified = DateTime()
+
+    def fail(self, error):
+        self.status = FAILED
+        self.errors = self.errors + (error, )
+        self.modified = DateTime()
+
+    def cancel(self):
+        if self.status in (PENDING, RUNNING, FAILED):
+            self.status = CANCELLED
+            self.modified = DateTime()
+
+    def resume(self):
+        """Resume a cancelled or failed job where it stopped"""
+        if self.status in (CANCELLED, FAILED):
+            self.status = self.position and RUNNING or PENDING
+            self.modified = DateTime()
+
+
+class JobsQueue(Persistent):
+    """Jobs by id, processed in id order"""
+
+    def __init__(self):
+        self._jobs = IOBTree()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter(self._jobs.values())
+
+    def get(self, id, default=None):
+        return self._jobs.get(id, default)
+
+    def add(self, category_path, paths, sort=False):
+        id = self._jobs and self._jobs.maxKey() + 1 or 1
+        job = self._jobs[id] = UpdateCategorizedElementsJob(
+            id, category_path, paths, sort=sort)
+        return job
+
+    def remove(self, id):
+        del self._jobs[id]
+
+    def next_job(self):
+        """Return the first pending or running job"""
+        for job in self._jobs.values():
+            if job.active:
+                return job
+
+    def purge(self):
+        """Remove finished and cancelled jobs"""
+        for job in list(self._jobs.values()):
+            if job.status in (FINISHED, CANCELLED):
+                del self._jobs[job.id]
+
+
+def get_jobs_queue(portal=None, create=True):
+    """Return the JobsQueue stored in p_portal annotations"""
+    portal = portal or api.portal.get()
+    annotations = IAnnotations(portal)
+    queue = annotations.get(JOBS_KEY)
+    if queue is None and create:
+        queue = annotations[JOBS_KEY] = JobsQueue()
+    return queue
+
+
+def get_jobs_threshold():
+    """Number of elements above which updates are done by a job"""
+    return get_settings().categorized_elements_jobs_threshold or 0
+
+
+def add_job(category, paths, sort=False):
+    """Queue a job updating the elements at p_paths for p_category"""
+    job = get_jobs_queue().add(
+        '/'.join(category.getPhysicalPath()), paths, sort=sort)
+    logger.info('Queued job {0} updating {1} categorized elements'.format(
+        job.id, job.total))
+    return job
+
+
+def process_chunk(portal, job, size):
+    """Update the next p_size elements of p_job"""
+    category = portal.unrestrictedTraverse(job.category_path, None)
+    paths = job.next_chunk(size)
+    with batched_updates():
+        for path in paths:
+            obj = portal.unrestrictedTraverse(path, None)
+            if obj is None:
+                # removed meanwhile
+                continue
+            notify(IconifiedCategoryChangedEvent(obj, category, sort=job.sort))
+    job.advance(len(paths))
+    if job.status == FINISHED and category is not None:
+        notify(CategorizedElementsUpdatedEvent(category))
+
+
+def process_jobs(portal, chunk_size=500, max_chunks=None):
+    """Process pending jobs of p_portal by chunks of p_chunk_size elements,
+       every chunk is committed in its own transaction.
+       Return the number of processed chunks."""
+    queue = get_jobs_queue(portal, create=False)
+    chunks = 0
+    while queue is not None and (max_chunks is None or chunks < max_chunks):
+        job = queue.next_job()
+        if job is None:
+            break
+        try:
+            process_chunk(portal, job, chunk_size)
+            transaction.commit()
+        except ConflictError:
+            # job processed by another worker or elements updated meanwhile,
+            # the chunk will be processed again next time
+            transaction.abort()
+            logger.warning('Conflict while processing job {0}'.format(job.id))
+            break
+        except Exception as exc:
+            transaction.abort()
+            logger.exception('Error while processing job {0}'.format(job.id))
+            job.fail('{0}: {1}'.format(exc.__class__.__name__, exc))
+            transaction.commit()
+            continue
+        chunks += 1
+        logger.info('Processed job {0}: {1}/{2} elements'.format(
+            job.id, job.position, job.total))
+    return chunks
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Rebuild the categorized elements of every container of a site.
+
+Containers are split in partitions by hash of their path so several
+processes (ZEO clients) may rebuild a partition each, see the
+`scripts/rebuild_categorized_elements.py` script.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from collective.iconifiedcategory import logger
+from collective.iconifiedcategory.utils import iter_brains_paths
+from collective.iconifiedcategory.utils import update_all_categorized_elements
+from ZODB.POSException import ConflictError
+
+import time
+import transaction
+import zlib
+
+
+MARKER_INTERFACE = ('collective.iconifiedcategory.behaviors.'
+                    'iconifiedcategorization.IIconifiedCategorizationMarker')
+
+# number of times a batch is retried when it conflicts
+RETRIES = 3
+
+
+def partition(path, partitions):
+    """Return the partition of p_path, stable between processes"""
+    return (zlib.crc32(path) & 0xffffffff) % partitions
+
+
+def container_paths(index=0, partitions=1):
+    """Return the sorted paths of the containers of categorized elements
+       in partition p_index of p_partitions"""
+    paths = set([path.rsplit('/', 1)[0] for path in
+                 iter_brains_paths(object_provides=MARKER_INTERFACE)])
+    return sorted([path for path in paths if partition(path, partitions) == index])
+
+
+def _rebuild_batch(portal, paths):
+    elements = 0
+    for path in paths:
+        container = portal.unrestrictedTraverse(path, None)
+        if container is None:
+            continue
+        update_all_categorized_elements(container)
+        elements += len(getattr(container, 'categorized_elements', ()))
+    return elements
+
+
+def rebuild_partition(portal, index=0, partitions=1, batch_size=100):
+    """Rebuild the categorized elements of the containers of partition
+       p_index, a transaction is committed every p_batch_size containers.
+       Return counts and timings."""
+    started = time.time()
+    paths = container_paths(index, partitions)
+    result = {
+        'partition': index,
+        'containers': len(paths),
+        'elements': 0,
+        'conflicts': 0,
+        'errors': 0,
+    }
+    logger.info('Rebuilding categorized elements of {0} containers (partition {1}/{2})'.format(
+        len(paths), index + 1, partitions))
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        for attempt in range(RETRIES + 1):
+            try:
+                elements = _rebuild_batch(portal, batch)
+                transaction.commit()
+            except ConflictError:
+                transaction.abort()
+                result['conflicts'] += 1
+                continue
+            except Exception:
+                transaction.abort()
+                logger.exception('Error while rebuilding {0}'.format(batch[0]))
+                result['errors'] += 1
+                break
+            result['elements'] += elements
+            break
+        else:
+            logger.error('Could not rebuild containers from {0}, too many conflicts'.format(
+                batch[0]))
+            result['errors'] += 1
+        portal._p_jar.cacheMinimize()
+        logger.info('Partition {0}/{1}: {2}/{3} containers'.format(
+            index + 1, partitions, min(start + batch_size, len(paths)), len(paths)))
+    result['seconds'] = round(time.time() - started, 2)
+    return result
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Process the jobs updating categorized elements of a Plone site.
+
+Usage: bin/instance run process_jobs.py <site id> [chunk size] [max chunks]
+
+Every chunk of elements is committed in its own transaction, the script may
+be interrupted and run again, jobs are resumed where they stopped.
+"""
+
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.User import UnrestrictedUser
+from collective.iconifiedcategory.jobs import process_jobs
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+import sys
+
+
+def script_args(argv):
+    # zopectl run arguments come before the script ones
+    for idx, arg in enumerate(argv):
+        if arg.endswith('.py'):
+            return argv[idx + 1:]
+    return argv[1:]
+
+
+def main(app, args):
+    if not args:
+        print(__doc__)
+        return 1
+    app = makerequest(app)
+    portal = app.unrestrictedTraverse(args[0])
+    setSite(portal)
+    user = UnrestrictedUser('system', '', ['Manager'], '')
+    newSecurityManager(None, user.__of__(app.acl_users))
+    chunk_size = len(args) > 1 and int(args[1]) or 500
+    max_chunks = len(args) > 2 and int(args[2]) or None
+    processed = process_jobs(portal, chunk_size=chunk_size, max_chunks=max_chunks)
+    print('{0} chunks processed'.format(processed))
+
+
+if __name__ == '__main__':
+    # 'app' is defined by zopectl run
+    sys.exit(main(app, script_args(sys.argv)))  # noqa
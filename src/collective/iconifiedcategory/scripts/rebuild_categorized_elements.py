@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuild the categorized elements of every container of a Plone site.
+
+Usage: bin/instance run rebuild_categorized_elements.py <site id>
+           [--workers N] [--batch-size 100] [--instance bin/instance]
+
+Containers are split in N partitions by hash of their path, every partition
+is rebuilt by its own worker process, started with the --instance script,
+so every worker is its own ZEO client and commits its own batches.  With one
+worker (the only possibility with a FileStorage not served by ZEO), the
+rebuild is done in this process.  A summary of counts, timings and conflicts
+is printed at the end.
+"""
+
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.User import UnrestrictedUser
+from collective.iconifiedcategory.rebuild import rebuild_partition
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SUMMARY_PREFIX = 'REBUILD RESULT '
+
+
+def script_args(argv):
+    # zopectl run arguments come before the script path and arguments
+    for idx, arg in enumerate(argv):
+        if arg.endswith('.py'):
+            return arg, argv[idx + 1:]
+    return argv[0], argv[1:]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Rebuild the categorized elements of a Plone site.')
+    parser.add_argument('site_id')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--instance', default='bin/instance')
+    # partition rebuilt by a worker process
+    parser.add_argument('--partition', type=int, default=None)
+    return parser.parse_args(args)
+
+
+def run_partition(app, options, index):
+    app = makerequest(app)
+    portal = app.unrestrictedTraverse(options.site_id)
+    setSite(portal)
+    user = UnrestrictedUser('system', '', ['Manager'], '')
+    newSecurityManager(None, user.__of__(app.acl_users))
+    return rebuild_partition(
+        portal, index=index, partitions=options.workers, batch_size=options.batch_size)
+
+
+def start_workers(script, options):
+    script = os.path.abspath(script)
+    workers = []
+    for index in range(options.workers):
+        command = [options.instance, 'run', script, options.site_id,
+                   '--workers', str(options.workers),
+                   '--batch-size', str(options.batch_size),
+                   '--partition', str(index)]
+        # output goes to a file, a worker never blocks on a full pipe
+        # while another worker is waited for
+        output = tempfile.TemporaryFile()
+        workers.append((subprocess.Popen(command, stdout=output), output))
+    results = []
+    for index, (worker, output) in enumerate(workers):
+        worker.wait()
+        output.seek(0)
+        lines = output.read().splitlines()
+        output.close()
+        summaries = [line for line in lines if line.startswith(SUMMARY_PREFIX)]
+        if worker.returncode or not summaries:
+            sys.stderr.write('Worker of partition {0} failed:\n{1}\n'.format(
+                index, '\n'.join(lines)))
+            results.append({'partition': index, 'failed': True, 'containers': 0,
+                            'elements': 0, 'conflicts': 0, 'errors': 1, 'seconds': 0})
+            continue
+        results.append(json.loads(summaries[-1][len(SUMMARY_PREFIX):]))
+    return results
+
+
+def print_summary(results, seconds):
+    print('{0:>9} {1:>10} {2:>10} {3:>9} {4:>6} {5:>9}'.format(
+        'partition', 'containers', 'elements', 'conflicts', 'errors', 'seconds'))
+    for result in results:
+        print('{0:>9} {1:>10} {2:>10} {3:>9} {4:>6} {5:>9}{6}'.format(
+            result['partition'], result['containers'], result['elements'],
+            result['conflicts'], result['errors'], result['seconds'],
+            result.get('failed') and ' (worker failed)' or ''))
+    print('{0:>9} {1:>10} {2:>10} {3:>9} {4:>6} {5:>9}'.format(
+        'total',
+        sum([r['containers'] for r in results]),
+        sum([r['elements'] for r in results]),
+        sum([r['conflicts'] for r in results]),
+        sum([r['errors'] for r in results]),
+        round(seconds, 2)))
+
+
+def main(app, script, args):
+    options = parse_args(args)
+    if options.partition is not None:
+        # worker process
+        result = run_partition(app, options, options.partition)
+        print(SUMMARY_PREFIX + json.dumps(result))
+        return 0
+    started = time.time()
+    if options.workers > 1:
+        results = start_workers(script, options)
+    else:
+        results = [run_partition(app, options, 0)]
+    print_summary(results, time.time() - started)
+    return sum([r['errors'] for r in results]) and 1 or 0
+
+
+if __name__ == '__main__':
+    # 'app' is defined by zopectl run
+    sys.exit(main(app, *script_args(sys.argv)))  # noqa
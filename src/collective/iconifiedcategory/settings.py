@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Immutable snapshot of the IIconifiedCategorySettings registry records.
+
+The snapshot is cached by thread and by site, it is dropped when one of these
+records is added, modified or removed (see record_changed) and after MAX_AGE
+seconds so changes made by another ZEO client are taken into account.  It is
+not cached while a record change is pending in the transaction of the thread,
+so an aborted change is not kept.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from plone.registry.interfaces import IRegistry
+from zope.component import getUtility
+from zope.component.hooks import getSite
+from zope.schema import getFieldsInOrder
+
+import threading
+import time
+import transaction
+
+
+PREFIX = IIconifiedCategorySettings.__identifier__ + '.'
+
+# seconds a snapshot is used before being read again from the registry
+MAX_AGE = 60
+
+_lock = threading.Lock()
+_local = threading.local()
+# bumped when a record is changed, snapshots of every thread are dropped
+_generation = [0]
+
+
+class SettingsSnapshot(object):
+    """Values of the IIconifiedCategorySettings records, a missing record
+       (upgrade step not run yet) has the field default value"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("'SettingsSnapshot' object is immutable")
+
+
+def build_settings():
+    registry = getUtility(IRegistry)
+    values = {}
+    for name, field in getFieldsInOrder(IIconifiedCategorySettings):
+        values[name] = registry.get(PREFIX + name, field.default)
+    return SettingsSnapshot(**values)
+
+
+def get_settings():
+    """Return the SettingsSnapshot of current site"""
+    if getattr(_local, 'changed_transaction', None) is transaction.get():
+        # a record was changed in current transaction, that may be aborted
+        return build_settings()
+    site = getSite()
+    key = site is not None and site.getPhysicalPath() or None
+    snapshots = getattr(_local, 'snapshots', None)
+    if snapshots is None:
+        snapshots = _local.snapshots = {}
+    cached = snapshots.get(key)
+    now = time.time()
+    if cached is not None and cached[0] == _generation[0] and now - cached[1] < MAX_AGE:
+        return cached[2]
+    settings = build_settings()
+    snapshots[key] = (_generation[0], now, settings)
+    return settings
+
+
+def invalidate(*args):
+    """Drop snapshots of every thread"""
+    with _lock:
+        _generation[0] += 1
+
+
+def record_changed(event):
+    """A registry record was added, modified or removed"""
+    name = getattr(event.record, '__name__', None) or ''
+    if not name.startswith(PREFIX):
+        return
+    invalidate()
+    txn = transaction.get()
+    _local.changed_transaction = txn
+    # other threads may read the record again before the change is committed
+    txn.addAfterCommitHook(invalidate)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Immutable in memory snapshot of a categories configuration.
+
+The snapshot is shared by every thread of the process and is rebuilt when
+the version stored on the config root changes, this version is bumped by
+the configuration subscribers (see content/events.py).  While configuration
+objects are modified in a transaction, a private snapshot is built once by
+change and used for the rest of the transaction.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from Acquisition import aq_base
+from Acquisition import aq_chain
+from Acquisition import aq_inner
+from collective.iconifiedcategory.content.base import config_changes
+from collective.iconifiedcategory.content.category import ICategory
+from collective.iconifiedcategory.content.categoryconfiguration import ICategoryConfiguration
+from collective.iconifiedcategory.content.categorygroup import ICategoryGroup
+from collective.iconifiedcategory.content.subcategory import ISubcategory
+
+import threading
+import transaction
+
+
+VERSION_ATTR = 'categories_version'
+
+GROUP_FLAGS = (
+    'to_be_printed_activated',
+    'confidentiality_activated',
+    'signed_activated',
+    'publishable_activated',
+)
+
+# category informations stored for a categorized element
+CATEGORY_INFOS_KEYS = (
+    'category_uid',
+    'category_id',
+    'category_title',
+    'subcategory_uid',
+    'subcategory_id',
+    'subcategory_title',
+    'icon_url',
+) + GROUP_FLAGS
+
+DEFAULT_VALUES = (
+    'to_print',
+    'confidential',
+    'to_sign',
+    'signed',
+    'publishable',
+)
+
+_lock = threading.Lock()
+_snapshots = {}
+_local = threading.local()
+
+
+class CategoryInfos(object):
+    """Immutable informations about a category or a subcategory.
+       UID(), getId() and Title() are provided so it may be used
+       where a category object is expected."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("'CategoryInfos' object is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("'CategoryInfos' object is immutable")
+
+    def __repr__(self):
+        return '<CategoryInfos {0}>'.format(self.calculated_id)
+
+    def UID(self):
+        return self.uid
+
+    def getId(self):
+        return self.id
+
+    def Title(self):
+        return self.title
+
+    @property
+    def basic_infos(self):
+        """Category related informations stored for a categorized element,
+           see CategorizedObjectInfoAdapter._get_basic_infos."""
+        return dict(self._basic_infos)
+
+
+class CategoriesSnapshot(object):
+    """Every categories and subcategories of a config root"""
+
+    def __init__(self, path, version, key=None):
+        self.path = path
+        self.version = version
+        # key is None if snapshot may not be shared
+        self.key = key
+        self._by_uid = {}
+        self._by_path = {}
+        self._categories = []
+        self._subcategories = {}
+        # values computed from a private snapshot (key is None), they can
+        # not be cached elsewhere, see utils.get_ordered_categories
+        self.memo = {}
+
+    def __len__(self):
+        return len(self._by_uid)
+
+    def __contains__(self, uid):
+        return uid in self._by_uid
+
+    def _add(self, infos):
+        self._by_uid[infos.uid] = infos
+        self._by_path[infos.path] = infos
+        if infos.is_subcategory:
+            self._subcategories.setdefault(infos.category_uid, []).append(infos)
+        else:
+            self._categories.append(infos)
+
+    def uids(self):
+        """Return UIDs of every categories and subcategories"""
+        return self._by_uid.keys()
+
+    def get(self, uid, default=None):
+        """Return the CategoryInfos for given category or subcategory UID"""
+        return self._by_uid.get(uid, default)
+
+    def get_by_path(self, path, default=None):
+        """Return the CategoryInfos for given path (tuple of ids),
+           relative to the config root"""
+        return self._by_path.get(tuple(path), default)
+
+    def relative_path(self, obj):
+        """Return path of p_obj relative to the config root or None
+           if p_obj is not in the config root"""
+        path = obj.getPhysicalPath()
+        if path[:len(self.path)] != self.path:
+            return
+        return tuple(path[len(self.path):])
+
+    def categories(self, group_path=(), only_enabled=True):
+        """Return categories of group at p_group_path ordered
+           like a catalog query sorted on getObjPositionInParent"""
+        length = len(group_path)
+        return [infos for infos in self._categories
+                if infos.path[:length] == tuple(group_path) and
+                (not only_enabled or infos.enabled)]
+
+    def subcategories(self, category_uid, only_enabled=True):
+        """Return subcategories of given category ordered by position"""
+        return [infos for infos in self._subcategories.get(category_uid, [])
+                if not only_enabled or infos.enabled]
+
+
+def get_version(config_root):
+    return getattr(aq_base(config_root), VERSION_ATTR, 0)
+
+
+def find_config_root(obj):
+    """Return the config root containing p_obj"""
+    for parent in aq_chain(aq_inner(obj)):
+        if ICategoryConfiguration.providedBy(parent):
+            return parent
+
+
+def _bumped_versions():
+    """Paths of the config roots whose version was bumped in current
+       transaction"""
+    txn = transaction.get()
+    if getattr(_local, 'bumped_transaction', None) is not txn:
+        _local.bumped_transaction = txn
+        _local.bumped = set()
+    return _local.bumped
+
+
+def bump_version(obj, once=False):
+    """Bump the version of the config root containing p_obj,
+       snapshots of this config root will be rebuilt.
+       If p_once is True, the version is not bumped again if it already was
+       in current transaction."""
+    config_root = find_config_root(obj)
+    if config_root is None:
+        return
+    bumped = _bumped_versions()
+    path = config_root.getPhysicalPath()
+    if once and path in bumped:
+        return
+    setattr(config_root, VERSION_ATTR, get_version(config_root) + 1)
+    bumped.add(path)
+
+
+def _transaction_snapshots():
+    """Snapshots built in current transaction, by config root path"""
+    txn = transaction.get()
+    if getattr(_local, 'transaction', None) is not txn:
+        _local.transaction = txn
+        _local.snapshots = {}
+    return _local.snapshots
+
+
+def _category_infos(obj, category, group, path, position, group_position):
+    from collective.iconifiedcategory import utils
+    is_subcategory = ISubcategory.providedBy(obj)
+    infos = {
+        'uid': obj.UID(),
+        'id': obj.getId(),
+        'title': obj.Title(),
+        'calculated_id': utils.calculate_category_id(obj),
+        'path': path,
+        'position': position,
+        'group_position': group_position,
+        'is_subcategory': is_subcategory,
+        'category_uid': category.UID(),
+        'enabled': getattr(obj, 'enabled', True),
+        'only_pdf': getattr(obj, 'only_pdf', False),
+        'predefined_title': getattr(obj, 'predefined_title', None),
+        'icon_url': utils.get_category_icon_url(obj),
+    }
+    for name in DEFAULT_VALUES:
+        infos[name] = getattr(obj, name, False)
+    basic_infos = {
+        'category_uid': category.UID(),
+        'category_id': category.getId(),
+        'category_title': category.Title(),
+        'subcategory_uid': None,
+        'subcategory_id': None,
+        'subcategory_title': None,
+        'icon_url': infos['icon_url'],
+    }
+    if is_subcategory:
+        basic_infos['subcategory_uid'] = infos['uid']
+        basic_infos['subcategory_id'] = infos['id']
+        basic_infos['subcategory_title'] = infos['title']
+    # same default as BaseView._may_set_values
+    for name in GROUP_FLAGS:
+        infos[name] = basic_infos[name] = getattr(group, name, True)
+    infos['_basic_infos'] = basic_infos
+    return CategoryInfos(**infos)
+
+
+def build_snapshot(config_root, key=None):
+    """Walk the config root and build a CategoriesSnapshot"""
+    root_path = config_root.getPhysicalPath()
+    snapshot = CategoriesSnapshot(root_path, get_version(config_root), key)
+    categories = []
+
+    def walk(container, group_position):
+        for position, obj in enumerate(container.objectValues()):
+            if ICategoryGroup.providedBy(obj):
+                walk(obj, position)
+            elif ICategory.providedBy(obj):
+                path = tuple(obj.getPhysicalPath()[len(root_path):])
+                group = obj.get_category_group()
+                categories.append(
+                    _category_infos(obj, obj, group, path, position, group_position))
+                for sub_position, sub in enumerate(obj.objectValues()):
+                    if not ISubcategory.providedBy(sub):
+                        continue
+                    snapshot._add(_category_infos(
+                        sub, obj, group, path + (sub.getId(), ), sub_position, group_position))
+
+    walk(config_root, 0)
+    # same order as a catalog query sorted on getObjPositionInParent
+    categories.sort(key=lambda infos: (infos.position, infos.group_position))
+    for infos in categories:
+        snapshot._add(infos)
+    return snapshot
+
+
+def get_snapshot(config_root):
+    """Return the CategoriesSnapshot of p_config_root.
+       Snapshot is shared until the config root version changes, if some
+       configuration objects are modified in current transaction, a private
+       snapshot is built and used until another change is made."""
+    path = config_root.getPhysicalPath()
+    changes = config_changes()
+    if changes or getattr(config_root, '_p_jar', None) is None:
+        snapshots = _transaction_snapshots()
+        key = (get_version(config_root), changes)
+        snapshot, snapshot_key = snapshots.get(path, (None, None))
+        if snapshot is None or snapshot_key != key:
+            snapshot = build_snapshot(config_root)
+            snapshots[path] = (snapshot, key)
+        return snapshot
+    # _p_serial makes sure we do not reuse a snapshot built for
+    # another database state having the same version
+    key = (path, get_version(config_root), config_root._p_serial)
+    snapshot = _snapshots.get(path)
+    if snapshot is None or snapshot.key != key:
+        snapshot = build_snapshot(config_root, key=key)
+        with _lock:
+            _snapshots[path] = snapshot
+    return snapshot
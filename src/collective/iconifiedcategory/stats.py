@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Process wide counters, useful to check that caches and optimizations
+are effective.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+import threading
+
+
+_lock = threading.Lock()
+_counters = {}
+
+
+def increment(name, value=1):
+    """Increment counter p_name of p_value."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get(name):
+    """Return current value of counter p_name."""
+    return _counters.get(name, 0)
+
+
+def get_all():
+    """Return a copy of every counters."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset(name=None):
+    """Reset counter p_name or every counters if p_name is None."""
+    with _lock:
+        if name is None:
+            _counters.clear()
+        else:
+            _counters.pop(name, None)
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+collective.iconifiedcategory
+----------------------------
+
+Persistent storage of the categorized elements informations of a container.
+
+Every element informations are stored in their own persistent record so
+changing an element only writes this record, not the whole container.
+Records resolve conflicts and the order is stored in BTrees so concurrent
+transactions adding, removing, updating or moving different elements of a
+container do not conflict.
+
+:license: GPL, see LICENCE.txt for more details.
+"""
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from collective.iconifiedcategory.settings import get_settings
+from itertools import islice
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from ZODB.POSException import ConflictError
+
+import collections
+import copy
+
+
+_marker = object()
+
+# informations of categorized elements that are indexed
+INDEXES = (
+    'category_uid',
+    'portal_type',
+    'to_print',
+    'confidential',
+    'to_sign',
+    'signed',
+    'publishable',
+)
+
+
+def _warn_filesize(infos):
+    filesize = infos.get('filesize')
+    return filesize is not None and filesize > get_settings().filesizelimit
+
+
+# informations of categorized elements computed when read, not stored
+COMPUTED = {
+    'warn_filesize': _warn_filesize,
+}
+
+
+class CategorizedElementInfos(PersistentMapping):
+    """Informations of a categorized element"""
+
+    def _p_resolveConflict(self, old, committed, new):
+        """Merge concurrent updates of different fields"""
+        old_data = old['data']
+        committed_data = committed['data']
+        new_data = new['data']
+        resolved = dict(committed_data)
+        for key in set(old_data) | set(new_data):
+            old_value = old_data.get(key, _marker)
+            new_value = new_data.get(key, _marker)
+            if new_value == old_value:
+                continue
+            committed_value = committed_data.get(key, _marker)
+            if committed_value != old_value and committed_value != new_value:
+                raise ConflictError
+            if new_value is _marker:
+                resolved.pop(key, None)
+            else:
+                resolved[key] = new_value
+        state = dict(committed)
+        state['data'] = resolved
+        return state
+
+
+class ReadOnlyInfos(collections.Mapping):
+    """Read only view on the informations of a categorized element,
+       p_extra informations (category informations of a normalized record)
+       and COMPUTED informations are added to the stored ones.  Nothing is
+       copied, values must not be modified, use copy() to get a modifiable
+       copy."""
+
+    __slots__ = ('_infos', '_extra')
+
+    def __init__(self, infos, extra=None):
+        # avoid the PersistentMapping overhead
+        self._infos = getattr(infos, 'data', infos)
+        self._extra = extra or {}
+
+    def __getitem__(self, key):
+        if key in COMPUTED:
+            return COMPUTED[key](self)
+        try:
+            return self._extra[key]
+        except KeyError:
+            return self._infos[key]
+
+    def __contains__(self, key):
+        return key in COMPUTED or key in self._extra or key in self._infos
+
+    def __iter__(self):
+        for key in self._infos:
+            if key not in self._extra and key not in COMPUTED:
+                yield key
+        for key in self._extra:
+            if key not in COMPUTED:
+                yield key
+        for key in COMPUTED:
+            yield key
+
+    def __len__(self):
+        return len(set(self._infos) | set(self._extra) | set(COMPUTED))
+
+    def __repr__(self):
+        return '<ReadOnlyInfos {0!r}>'.format(dict(self))
+
+    def copy(self):
+        """Return a deep copy as a dict"""
+        return copy.deepcopy(dict(self))
+
+
+# entries of elements having a sort key come first, then appended elements
+_KEYED = 0
+_APPENDED = 1
+
+
+class CategorizedElementsOrder(Persistent):
+    """Order of the categorized elements of a container.
+       Every element has an entry (group, sort key, sequence, uid) stored in
+       a OOTreeSet, iterating entries gives the order.  Adding, moving or
+       removing an element only changes a few buckets and concurrent changes
+       of different elements are merged by the BTrees conflict resolution.
+       Elements without sort key are appended after sorted elements, the
+       sequence keeps the order of elements having the same key.
+       p_version is the categories version keys were computed for, keys are
+       computed again when it changes."""
+
+    version = None
+    # former instances stored a list of uids and a dict of keys,
+    # they are converted when modified
+    _entries = None
+
+    def __init__(self, uids=()):
+        self._init()
+        self.set(uids)
+
+    def _init(self):
+        self._entries = OOTreeSet()
+        # uid -> entry
+        self._entry_of = OOBTree()
+        self._sequence = Length()
+
+    def _migrate(self):
+        if self._entries is not None:
+            return
+        uids = self.__dict__.pop('uids', [])
+        keys = self.__dict__.pop('keys', {})
+        self._init()
+        self.set(uids, keys, self.version)
+
+    def _next_sequence(self):
+        self._sequence.change(1)
+        return self._sequence()
+
+    @property
+    def uids(self):
+        if self._entries is None:
+            return list(self.__dict__.get('uids', []))
+        return [entry[-1] for entry in self._entries.keys()]
+
+    @property
+    def keys(self):
+        if self._entries is None:
+            return dict(self.__dict__.get('keys', {}))
+        return dict([(entry[-1], entry[1]) for entry in
+                     self._entries.keys(max=(_APPENDED, ), excludemax=True)])
+
+    def __iter__(self):
+        return iter(self.uids)
+
+    def __len__(self):
+        if self._entries is None:
+            return len(self.__dict__.get('uids', []))
+        return len(self._entry_of)
+
+    def append(self, uid):
+        self._migrate()
+        entry = (_APPENDED, None, self._next_sequence(), uid)
+        self._entries.insert(entry)
+        self._entry_of[uid] = entry
+
+    def remove(self, uid):
+        self._migrate()
+        entry = self._entry_of.pop(uid)
+        self._entries.remove(entry)
+
+    def set(self, uids, keys=None, version=None):
+        """Store p_uids order, p_uids must be sorted by p_keys.
+           If some elements have no key, p_uids order is kept without key."""
+        self._migrate()
+        uids = list(uids)
+        keys = keys or {}
+        keyed = len(keys) == len(uids) and all([uid in keys for uid in uids])
+        self._entries.clear()
+        self._entry_of.clear()
+        for idx, uid in enumerate(uids):
+            if keyed:
+                entry = (_KEYED, keys[uid], idx, uid)
+            else:
+                entry = (_APPENDED, None, idx, uid)
+            self._entries.insert(entry)
+            self._entry_of[uid] = entry
+        self._sequence.set(len(uids))
+        if version != self.version:
+            self.version = version
+
+    def _appended(self, limit):
+        """UIDs of the first p_limit elements without key"""
+        if self._entries is None:
+            keys = self.__dict__.get('keys', {})
+            return [uid for uid in self.uids if uid not in keys][:limit]
+        return [entry[-1] for entry in islice(
+            self._entries.keys(min=(_APPENDED, )), limit)]
+
+    def is_sorted(self, version, uid=None):
+        """Are elements sorted by keys computed for p_version?
+           p_uid may be an element without key, that will be moved."""
+        if version != self.version:
+            return False
+        appended = self._appended(2)
+        return not appended or (uid is not None and appended == [uid])
+
+    def move(self, uid, key):
+        """Move p_uid to the position of p_key, after elements having the
+           same key, elements must be sorted"""
+        self._migrate()
+        entry = self._entry_of.get(uid)
+        if entry is not None:
+            if entry[0] == _KEYED and entry[1] == key:
+                return
+            self._entries.remove(entry)
+        entry = (_KEYED, key, self._next_sequence(), uid)
+        self._entries.insert(entry)
+        self._entry_of[uid] = entry
+
+    def positions(self, uids):
+        """Return p_uids sorted by position"""
+        if self._entries is None:
+            positions = dict([(uid, idx) for idx, uid in enumerate(self.uids)])
+            return sorted(uids, key=positions.get)
+        return sorted(uids, key=self._entry_of.get)
+
+
+class CategorizedElements(Persistent):
+    """Categorized elements informations of a container, by UID.
+       This behaves like the OrderedDict formerly used, iteration follows
+       the stored order.  Elements are indexed on INDEXES."""
+
+    _indexes = None
+
+    def __init__(self, items=()):
+        self._records = OOBTree()
+        self._order = CategorizedElementsOrder()
+        self._init_indexes()
+        for uid, infos in items:
+            self[uid] = infos
+
+    def _init_indexes(self):
+        # index name -> (value, uid), concurrent transactions indexing
+        # different elements under a new value are merged
+        self._indexes = OOBTree()
+        for name in INDEXES:
+            self._indexes[name] = OOTreeSet()
+        # uid -> indexed values, to unindex as records are modified in place
+        self._indexed = OOBTree()
+
+    def _has_indexes(self):
+        """Elements stored by older versions are not indexed or are indexed
+           by value then uid, they are indexed again when modified"""
+        return self._indexes is not None and \
+            isinstance(self._indexes[INDEXES[0]], OOTreeSet)
+
+    def reindex(self, uid=None):
+        """Index element p_uid, every elements if p_uid is None"""
+        if not self._has_indexes():
+            self._init_indexes()
+            uid = None
+        if uid is None:
+            for uid in self._records.keys():
+                self._index_element(uid)
+        else:
+            self._index_element(uid)
+
+    def _index_element(self, uid):
+        record = self._records[uid]
+        values = tuple([record.get(name) for name in INDEXES])
+        old_values = self._indexed.get(uid)
+        if values == old_values:
+            return
+        if old_values is not None:
+            self._unindex_element(uid)
+        for name, value in zip(INDEXES, values):
+            self._indexes[name].insert((value, uid))
+        self._indexed[uid] = values
+
+    def _unindex_element(self, uid):
+        old_values = self._indexed.get(uid)
+        if old_values is None:
+            return
+        for name, value in zip(INDEXES, old_values):
+            if (value, uid) in self._indexes[name]:
+                self._indexes[name].remove((value, uid))
+        del self._indexed[uid]
+
+    def _indexed_uids(self, name, value):
+        """UIDs of elements having p_value for index p_name"""
+        for indexed_value, uid in self._indexes[name].keys(min=(value, )):
+            if indexed_value != value:
+                break
+            yield uid
+
+    def search(self, **query):
+        """Return the set of UIDs of elements matching every p_query
+           index name/value, like search(portal_type='File', to_print=True)"""
+        if not self._has_indexes():
+            return set([uid for uid, infos in self._records.items()
+                        if all([infos.get(name) == value for name, value in query.items()])])
+        result = None
+        for name, value in query.items():
+            uids = set(self._indexed_uids(name, value))
+            result = uids if result is None else result & uids
+            if not result:
+                break
+        return result if result is not None else set(self._records.keys())
+
+    def count(self, name, value):
+        """Return the number of elements having p_value for index p_name"""
+        if not self._has_indexes():
+            return len(self.search(**{name: value}))
+        return len(list(self._indexed_uids(name, value)))
+
+    def ordered(self, uids):
+        """Return the stored UIDs among p_uids, sorted by position"""
+        return self._order.positions([uid for uid in uids if uid in self._records])
+
+    def __repr__(self):
+        return '<CategorizedElements of {0} elements>'.format(len(self))
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __contains__(self, uid):
+        return uid in self._records
+
+    has_key = __contains__
+
+    def __getitem__(self, uid):
+        return self._records[uid]
+
+    def get(self, uid, default=None):
+        return self._records.get(uid, default)
+
+    def __setitem__(self, uid, infos):
+        self.add(uid, infos)
+
+    def add(self, uid, infos, key=None):
+        """Store p_infos of element p_uid, the element is moved to the
+           position of sort key p_key if given, else a new element is appended"""
+        record = self._records.get(uid)
+        if record is None:
+            self._records[uid] = CategorizedElementInfos(infos)
+            if key is None:
+                self._order.append(uid)
+        elif record is not infos:
+            record.clear()
+            record.update(infos)
+        if key is not None:
+            self._order.move(uid, key)
+        self.reindex(uid)
+
+    def __delitem__(self, uid):
+        if self._has_indexes():
+            self._unindex_element(uid)
+        del self._records[uid]
+        self._order.remove(uid)
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        return list(self._order)
+
+    def values(self):
+        return [self._records[uid] for uid in self._order]
+
+    def items(self):
+        return [(uid, self._records[uid]) for uid in self._order]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def update(self, other):
+        for uid, infos in other.items():
+            self[uid] = infos
+
+    def clear(self):
+        self._records.clear()
+        self._order.set([])
+        self._init_indexes()
+
+    def set_order(self, uids, keys=None, version=None):
+        """Store a new order, p_uids must contain every stored UIDs,
+           p_keys are the sort keys used to compute this order by UID"""
+        uids = list(uids)
+        keys = dict(keys or {})
+        order = self._order
+        if uids != order.uids or keys != order.keys or version != order.version:
+            order.set(uids, keys, version)
+
+    def is_sorted(self, version, uid=None):
+        """Is order computed with sort keys for categories p_version?"""
+        return self._order.is_sorted(version, uid=uid)
+
+    def move(self, uid, key):
+        """Move element p_uid to the position of sort key p_key"""
+        self._order.move(uid, key)
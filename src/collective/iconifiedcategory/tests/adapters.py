@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from collective.iconifiedcategory.adapter import CategorizedElementsFilterAdapter
 from collective.iconifiedcategory.adapter import CategorizedObjectAdapter
 
 
@@ -10,3 +11,13 @@ class TestingCategorizedObjectAdapter(CategorizedObjectAdapter):
             return False
         else:
             return True
+
+
+class TestingCategorizedElementsFilterAdapter(CategorizedElementsFilterAdapter):
+
+    def can_view(self, uid, infos):
+        """Same as TestingCategorizedObjectAdapter.can_view."""
+        if infos['confidential']:
+            return False
+        else:
+            return True
@@ -9,7 +9,9 @@ Created by mpeeters
 
 from time import sleep
 
+from borg.localrole.interfaces import ILocalRoleProvider
 from zope.annotation import IAnnotations
+from zope.component import getGlobalSiteManager
 from zope.component import getMultiAdapter
 from zope.event import notify
 from zope.lifecycleevent import ObjectModifiedEvent
@@ -19,6 +21,7 @@ from plone.app.contenttypes.interfaces import IImage
 from plone.app.contenttypes.interfaces import ILink
 from plone.namedfile.utils import stream_data
 from zope.interface import alsoProvides
+from zope.interface import implements
 
 from collective.documentviewer.async import queueJob
 from collective.documentviewer.config import CONVERTABLE_TYPES
@@ -30,6 +33,19 @@ from collective.iconifiedcategory.tests.base import BaseTestCase
 from collective.iconifiedcategory.utils import get_category_object
 
 
+class EditorRoleProvider(object):
+    """Give the Editor role to 'someone'"""
+    implements(ILocalRoleProvider)
+
+    def __init__(self, context):
+        self.context = context
+
+    def getRoles(self, principal_id):
+        return principal_id == 'someone' and ('Editor', ) or ()
+
+    def getAllRoles(self):
+        yield 'someone', ('Editor', )
+
 class TestCategorizedObjectInfoAdapter(BaseTestCase):
 
     def test_get_infos_for_file(self):
@@ -47,11 +63,15 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'category_uid': category.category_uid,
              'confidential': False,
              'confidentiality_activated': False,
+             'created': obj.created(),
+             'creator': obj.Creator(),
              'description': obj.Description(),
              'download_url': u'file_txt/@@download',
              'filesize': 3017,
              'icon_url': u'config/group-1/category-1-1/@@images/{0}'.format(scale),
              'id': obj.getId(),
+             'modified': obj.modified(),
+             'modifyRolesAndUsers': file_adapter._modifyRolesAndUsers,
              'portal_type': obj.portal_type,
              'preview_status': 'not_convertable',
              'publishable': False,
@@ -65,8 +85,7 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'title': obj.Title(),
              'to_be_printed_activated': True,
              'to_print': None,
-             'to_sign': False,
-             'warn_filesize': False})
+             'to_sign': False})
 
     def test_get_infos_for_image(self):
         obj = self.portal['image']
@@ -85,11 +104,15 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'category_uid': subcategory.category_uid,
              'confidential': False,
              'confidentiality_activated': False,
+             'created': obj.created(),
+             'creator': obj.Creator(),
              'description': obj.Description(),
              'download_url': u'image/@@download',
              'filesize': 3742,
              'icon_url': u'config/group-1/category-1-1/@@images/{0}'.format(scale),
              'id': obj.getId(),
+             'modified': obj.modified(),
+             'modifyRolesAndUsers': image_adapter._modifyRolesAndUsers,
              'portal_type': obj.portal_type,
              'preview_status': 'not_convertable',
              'publishable': False,
@@ -103,8 +126,7 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'title': obj.Title(),
              'to_be_printed_activated': True,
              'to_print': False,
-             'to_sign': False,
-             'warn_filesize': False})
+             'to_sign': False})
 
     def test_get_infos_with_subcategory(self):
         obj = self.portal['file_txt']
@@ -123,11 +145,15 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'category_uid': subcategory.category_uid,
              'confidential': False,
              'confidentiality_activated': False,
+             'created': obj.created(),
+             'creator': obj.Creator(),
              'description': obj.Description(),
              'download_url': u'file_txt/@@download',
              'filesize': 3017,
              'icon_url': u'config/group-1/category-1-1/@@images/{0}'.format(scale),
              'id': obj.getId(),
+             'modified': obj.modified(),
+             'modifyRolesAndUsers': file_adapter._modifyRolesAndUsers,
              'portal_type': obj.portal_type,
              'preview_status': 'not_convertable',
              'publishable': False,
@@ -141,8 +167,25 @@ class TestCategorizedObjectInfoAdapter(BaseTestCase):
              'title': obj.Title(),
              'to_be_printed_activated': True,
              'to_print': None,
-             'to_sign': False,
-             'warn_filesize': False})
+             'to_sign': False})
+
+    def test_modify_roles_and_users(self):
+        file_adapter = adapter.CategorizedObjectInfoAdapter(self.portal['file_txt'])
+        allowed = file_adapter._modifyRolesAndUsers
+        self.assertTrue('Manager' in allowed)
+        # Owner local role
+        self.assertTrue('user:adminuser' in allowed)
+        self.assertFalse('Owner' in allowed)
+        self.assertFalse('Anonymous' in allowed)
+        self.assertFalse('user:someone' in allowed)
+
+        # local roles given by a borg.localrole adapter
+        gsm = getGlobalSiteManager()
+        gsm.registerAdapter(EditorRoleProvider, (IFile, ), ILocalRoleProvider, name='editor')
+        try:
+            self.assertTrue('user:someone' in file_adapter._modifyRolesAndUsers)
+        finally:
+            gsm.unregisterAdapter(EditorRoleProvider, (IFile, ), ILocalRoleProvider, name='editor')
 
     def test_category(self):
         file_adapter = adapter.CategorizedObjectInfoAdapter(
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import batch
+from collective.iconifiedcategory import logger
+from collective.iconifiedcategory import stats
+from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.tests.base import BaseTestCase
+from plone import api
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
+
+import logging
+import transaction
+
+
+class RecordsHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestBatchedUpdates(BaseTestCase):
+
+    def _create(self, container, id, title):
+        return api.content.create(
+            id=id,
+            title=title,
+            type='File',
+            file=self.file,
+            container=container,
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+
+    def test_batched_updates(self):
+        container = api.content.create(id='folder', type='Folder', container=self.portal)
+        stats.reset('batched_elements_updated')
+        with batch.batched_updates() as updates:
+            file3 = self._create(container, 'file3', 'File 3')
+            file2 = self._create(container, 'file2', 'File 2')
+            file1 = self._create(container, 'file1', 'File 1')
+            file2.title = 'File 4'
+            notify(ObjectModifiedEvent(file2))
+            # nothing updated until the batch is flushed
+            self.assertEqual(len(getattr(container, 'categorized_elements', {})), 0)
+            self.assertEqual(len(updates), 1)
+            # nested blocks are part of the batch
+            with batch.batched_updates() as nested:
+                self.assertTrue(nested is updates)
+        self.assertIsNone(batch.get_batch())
+        # one update by element
+        self.assertEqual(stats.get('batched_elements_updated'), 3)
+        self.assertEqual(
+            container.categorized_elements.keys(),
+            [file1.UID(), file3.UID(), file2.UID()])
+        self.assertEqual(container.categorized_elements[file2.UID()]['title'], 'File 4')
+
+    def test_batched_updates_removed_element(self):
+        container = api.content.create(id='folder', type='Folder', container=self.portal)
+        with batch.batched_updates():
+            file1 = self._create(container, 'file1', 'File 1')
+            self._create(container, 'file2', 'File 2')
+            api.content.delete(container['file2'])
+        self.assertEqual(container.categorized_elements.keys(), [file1.UID()])
+
+    def test_batched_updates_logging(self):
+        container = api.content.create(id='folder', type='Folder', container=self.portal)
+        file1 = self._create(container, 'file1', 'File 1')
+        category = utils.get_category_object(file1, file1.content_category)
+        handler = RecordsHandler()
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            with batch.batched_updates():
+                utils.update_categorized_elements(container, file1, category, logging=True)
+                self.assertEqual(handler.messages, [])
+            # logged when flushed
+            self.assertEqual(
+                handler.messages,
+                ['Updated categorized elements of {0}'.format(file1.absolute_url_path())])
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+    def test_batched_updates_error(self):
+        container = api.content.create(id='folder', type='Folder', container=self.portal)
+        try:
+            with batch.batched_updates():
+                self._create(container, 'file1', 'File 1')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIsNone(batch.get_batch())
+        self.assertEqual(len(getattr(container, 'categorized_elements', {})), 0)
+        # not batched anymore
+        file2 = self._create(container, 'file2', 'File 2')
+        self.assertEqual(container.categorized_elements.keys(), [file2.UID()])
+
+    def test_batch_until_commit(self):
+        container = api.content.create(id='folder', type='Folder', container=self.portal)
+        transaction.commit()
+        updates = batch.batch_until_commit()
+        self.assertTrue(batch.batch_until_commit() is updates)
+        file2 = self._create(container, 'file2', 'File 2')
+        file1 = self._create(container, 'file1', 'File 1')
+        self.assertEqual(len(getattr(container, 'categorized_elements', {})), 0)
+        transaction.commit()
+        self.assertIsNone(batch.get_batch())
+        self.assertEqual(
+            container.categorized_elements.keys(),
+            [file1.UID(), file2.UID()])
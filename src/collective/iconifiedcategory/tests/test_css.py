@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from collective.iconifiedcategory import stats
+from collective.iconifiedcategory.browser.css import get_sprite
+from collective.iconifiedcategory.browser.css import MAX_AGE
+from collective.iconifiedcategory.browser.css import SPRITE_VIEW
+from collective.iconifiedcategory.browser.viewlets import CategoriesStylesheetViewlet
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
 from collective.iconifiedcategory.tests.base import BaseTestCase
+from email.utils import formatdate
+from io import BytesIO
+from PIL import Image
 from plone import api
 
+import transaction
+
 
 class TestIconifiedCategoryCSS(BaseTestCase):
 
@@ -28,31 +39,129 @@ class TestIconifiedCategoryCSS(BaseTestCase):
         api.content.delete(self.portal['config'])
         self.assertEqual(view(), '')
 
-    def test_css_recooked(self):
-        """portal_css is recooked when a category is added/moved/removed."""
-        def _current_css_cachekey():
-            cachekey = [k for k, v in self.portal.portal_css.concatenatedResourcesByTheme['Plone Default'].items()
-                        if 'collective-iconifiedcategory.css' in v and '-cachekey-' in k][0]
-            return cachekey
-        # portal_css is cooked, the collective-iconfiedcategory.css is stored in a cachekey cooked css
-        cachekey1 = _current_css_cachekey()
-        # add a category, css resources are cooked again
+    def test_css_regenerated(self):
+        """css changes when a category is added/moved/removed."""
+        view = self.portal.restrictedTraverse('@@collective-iconifiedcategory.css')
+        self.assertFalse('brand-new-category' in view())
+        # add a category
         category = api.content.create(
             type='ContentCategory',
             title='Brand new category',
             icon=self.icon,
             container=self.portal.config['group-1'],
         )
-        cachekey2 = _current_css_cachekey()
-        self.assertNotEqual(cachekey1, cachekey2)
+        self.assertTrue('.plone-config-group-1-brand-new-category ' in view())
 
-        # rename the category so it is moved, css resources are cooked again
+        # rename the category
         category_parent = category.aq_inner.aq_parent
         category_parent.manage_renameObject(category.getId(), 'renamed_id')
-        cachekey3 = _current_css_cachekey()
-        self.assertNotEqual(cachekey2, cachekey3)
+        css = view()
+        self.assertFalse('brand-new-category' in css)
+        self.assertTrue('.plone-config-group-1-renamed_id ' in css)
+
+        # remove the category
+        api.content.delete(category_parent['renamed_id'])
+        self.assertFalse('renamed_id' in view())
+
+    def test_css_cached(self):
+        transaction.commit()
+        request = self.portal.REQUEST
+        response = request.response
+        view = self.portal.restrictedTraverse('@@collective-iconifiedcategory.css')
+        css = view()
+        hits = stats.get('css_cache_hits')
+        self.assertEqual(view(), css)
+        self.assertEqual(stats.get('css_cache_hits'), hits + 1)
+        etag = response.getHeader('ETag')
+        self.assertTrue(etag)
+        # last modification of the categories configuration
+        self.assertEqual(
+            response.getHeader('Last-Modified'),
+            formatdate(int(self.portal.config._p_mtime), usegmt=True))
+        self.assertEqual(response.getHeader('Cache-Control'),
+                         'public, max-age=0, must-revalidate')
+
+        # fingerprinted url
+        request.form['v'] = etag.strip('"')
+        view()
+        self.assertEqual(response.getHeader('Cache-Control'),
+                         'public, max-age={0}'.format(MAX_AGE))
+
+        # conditional requests
+        request.environ['HTTP_IF_NONE_MATCH'] = etag
+        self.assertEqual(view(), '')
+        self.assertEqual(response.getStatus(), 304)
+        request.environ['HTTP_IF_NONE_MATCH'] = '"other"'
+        response.setStatus(200)
+        self.assertEqual(view(), css)
+        self.assertEqual(response.getStatus(), 200)
+        del request.environ['HTTP_IF_NONE_MATCH']
+        request.environ['HTTP_IF_MODIFIED_SINCE'] = response.getHeader('Last-Modified')
+        self.assertEqual(view(), '')
+        self.assertEqual(response.getStatus(), 304)
+        del request.environ['HTTP_IF_MODIFIED_SINCE']
+        del request.form['v']
+        response.setStatus(200)
+
+    def test_stylesheet_viewlet(self):
+        request = self.portal.REQUEST
+        viewlet = CategoriesStylesheetViewlet(self.portal['file_txt'], request, None, None)
+        viewlet.update()
+        etag = self.portal.restrictedTraverse('@@collective-iconifiedcategory.css').get_resource()[1]
+        self.assertEqual(
+            viewlet.render(),
+            u'<link rel="stylesheet" type="text/css" media="screen" '
+            u'href="http://nohost/plone/@@collective-iconifiedcategory.css?v={0}" />'.format(etag))
+        # stylesheet changed, new URL
+        api.content.create(
+            type='ContentCategory',
+            title='Brand new category',
+            icon=self.icon,
+            container=self.portal.config['group-1'],
+        )
+        self.assertFalse(etag in viewlet.render())
+
+        # no config
+        api.content.delete(self.portal['file_txt'])
+        api.content.delete(self.portal['image'])
+        api.content.delete(self.portal['config'])
+        self.assertEqual(viewlet.render(), u'')
+
+    def test_css_icons_modes(self):
+        view = self.portal.restrictedTraverse('@@collective-iconifiedcategory.css')
+        api.portal.set_registry_record(
+            'css_icons_mode', 'sprite', interface=IIconifiedCategorySettings)
+        css = view()
+        sprite_view = self.portal.restrictedTraverse('@@collective-iconifiedcategory-sprite.png')
+        data, etag = get_sprite(self.portal)[:2]
+        self.assertEqual(sprite_view(), data)
+        self.assertEqual(self.portal.REQUEST.response.getHeader('Content-Type'), 'image/png')
+        # icons of the 6 categories, one under the other
+        self.assertEqual(Image.open(BytesIO(data)).size, (16, 96))
+        self.assertTrue(
+            u".plone-config-group-1-category-1-1 { padding-left: 1.4em; background: transparent "
+            u"url('http://nohost/plone/config/{0}?v={1}') no-repeat 0 -0px; }}".format(SPRITE_VIEW, etag)
+            in css)
+        self.assertTrue(u"no-repeat 0 -16px; }" in css)
+        self.assertFalse(u'@@download' in css)
+
+        # size of the 'listing' scale
+        imaging_properties = api.portal.get_tool('portal_properties').imaging_properties
+        allowed_sizes = imaging_properties.getProperty('allowed_sizes')
+        imaging_properties.manage_changeProperties(
+            allowed_sizes=[size for size in allowed_sizes
+                           if not size.startswith('listing ')] + ['listing 32:32'])
+        self.assertEqual(Image.open(BytesIO(get_sprite(self.portal)[0])).size, (32, 192))
+        self.assertTrue(u"no-repeat 0 -32px; }" in view())
+        imaging_properties.manage_changeProperties(allowed_sizes=allowed_sizes)
+
+        api.portal.set_registry_record(
+            'css_icons_mode', 'data-uri', interface=IIconifiedCategorySettings)
+        css = view()
+        self.assertTrue(u".plone-config-group-1-category-1-1 { padding-left: 1.4em; background: "
+                        u"transparent url('data:image/png;base64," in css)
+        self.assertFalse(u'@@download' in css)
 
-        # remove the category, css resources are cooked again
-        api.content.delete(category)
-        cachekey4 = _current_css_cachekey()
-        self.assertNotEqual(cachekey3, cachekey4)
+        api.portal.set_registry_record(
+            'css_icons_mode', 'url', interface=IIconifiedCategorySettings)
+        self.assertTrue(u'@@download' in view())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import jobs
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from collective.iconifiedcategory.tests.base import BaseTestCase
+from plone import api
+
+
+class TestJobs(BaseTestCase):
+
+    def setUp(self):
+        super(TestJobs, self).setUp()
+        api.portal.set_registry_record(
+            'categorized_elements_jobs_threshold', 1,
+            interface=IIconifiedCategorySettings)
+        self.category = self.config['group-1']['category-1-1']
+
+    def tearDown(self):
+        self.category.title = 'Category 1-1'
+        api.portal.set_registry_record(
+            'categorized_elements_jobs_threshold', 1000,
+            interface=IIconifiedCategorySettings)
+        super(TestJobs, self).tearDown()
+
+    def _element(self, id):
+        uid = self.portal[id].UID()
+        return self.portal.categorized_elements[uid]
+
+    def test_update_by_job(self):
+        self.category.title = 'Category 1-1 Modified'
+        self.config.restrictedTraverse('@@update-categorized-elements')()
+        # elements are updated by a job
+        queue = jobs.get_jobs_queue(self.portal)
+        job = queue.next_job()
+        self.assertEqual(job.total, 2)
+        self.assertEqual(job.status, jobs.PENDING)
+        self.assertEqual(self._element('file_txt')['category_title'], 'Category 1-1')
+
+        self.assertEqual(jobs.process_jobs(self.portal, chunk_size=1, max_chunks=1), 1)
+        self.assertEqual(job.status, jobs.RUNNING)
+        self.assertEqual(job.position, 1)
+        self.assertEqual(jobs.process_jobs(self.portal, chunk_size=1), 1)
+        self.assertEqual(job.status, jobs.FINISHED)
+        self.assertIsNone(queue.next_job())
+        self.assertEqual(self._element('file_txt')['category_title'], 'Category 1-1 Modified')
+        self.assertEqual(self._element('image')['category_title'], 'Category 1-1 Modified')
+
+        queue.purge()
+        self.assertEqual(len(queue), 0)
+
+    def test_cancel_resume(self):
+        self.category.title = 'Category 1-1 Modified'
+        self.category.restrictedTraverse('@@update-categorized-elements')()
+        queue = jobs.get_jobs_queue(self.portal)
+        job = queue.next_job()
+        job.cancel()
+        self.assertEqual(job.status, jobs.CANCELLED)
+        self.assertEqual(jobs.process_jobs(self.portal), 0)
+        self.assertEqual(self._element('file_txt')['category_title'], 'Category 1-1')
+
+        job.resume()
+        self.assertEqual(job.status, jobs.PENDING)
+        self.assertEqual(jobs.process_jobs(self.portal), 1)
+        self.assertEqual(job.status, jobs.FINISHED)
+        self.assertEqual(self._element('file_txt')['category_title'], 'Category 1-1 Modified')
+
+    def test_removed_element(self):
+        self.config.restrictedTraverse('@@update-categorized-elements')()
+        api.content.delete(self.portal['image'])
+        self.assertEqual(jobs.process_jobs(self.portal), 1)
+        job = jobs.get_jobs_queue(self.portal).get(1)
+        self.assertEqual(job.status, jobs.FINISHED)
+        self.assertEqual(job.errors, ())
+
+    def test_status_view(self):
+        view = self.portal.restrictedTraverse('@@categorized-elements-jobs')
+        self.assertEqual(view.jobs(), [])
+        self.config.restrictedTraverse('@@update-categorized-elements')()
+        self.assertEqual(len(view.jobs()), 1)
+        self.assertTrue('0/2 (0%)' in view())
+        view.apply('cancel', '1')
+        self.assertEqual(view.jobs()[0].status, jobs.CANCELLED)
+        view.apply('purge')
+        self.assertEqual(view.jobs(), [])
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import rebuild
+from collective.iconifiedcategory.tests.base import BaseTestCase
+
+
+class TestRebuild(BaseTestCase):
+
+    def test_partition(self):
+        paths = ['/plone/folder-{0}'.format(idx) for idx in range(20)]
+        partitions = [rebuild.partition(path, 3) for path in paths]
+        self.assertEqual(set(partitions), set([0, 1, 2]))
+        # stable
+        self.assertEqual(partitions, [rebuild.partition(path, 3) for path in paths])
+
+    def test_rebuild_partition(self):
+        portal_path = '/'.join(self.portal.getPhysicalPath())
+        self.assertEqual(rebuild.container_paths(), [portal_path])
+        index = rebuild.partition(portal_path, 2)
+        self.assertEqual(rebuild.container_paths(1 - index, 2), [])
+
+        uid = self.portal['file_txt'].UID()
+        del self.portal.categorized_elements[uid]
+        result = rebuild.rebuild_partition(self.portal, index, 2)
+        self.assertTrue(uid in self.portal.categorized_elements)
+        self.assertEqual(result['containers'], 1)
+        self.assertEqual(result['elements'], 2)
+        self.assertEqual(result['conflicts'], 0)
+        self.assertEqual(result['errors'], 0)
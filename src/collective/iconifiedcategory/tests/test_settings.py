@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import settings
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from collective.iconifiedcategory.tests.base import BaseTestCase
+from plone import api
+from plone.registry.interfaces import IRegistry
+from zope.component import getUtility
+
+import transaction
+
+
+class TestSettings(BaseTestCase):
+
+    def test_get_settings(self):
+        values = settings.get_settings()
+        self.assertEqual(values.filesizelimit, 5000000)
+        self.assertTrue(values.sort_categorized_tab)
+        self.assertEqual(values.css_icons_mode, 'url')
+        # cached
+        self.assertTrue(settings.get_settings() is values)
+        self.assertRaises(AttributeError, setattr, values, 'filesizelimit', 1)
+
+        # invalidated when a record is modified
+        api.portal.set_registry_record(
+            'filesizelimit', 1000, interface=IIconifiedCategorySettings)
+        try:
+            self.assertFalse(settings.get_settings() is values)
+            self.assertEqual(settings.get_settings().filesizelimit, 1000)
+        finally:
+            api.portal.set_registry_record(
+                'filesizelimit', 5000000, interface=IIconifiedCategorySettings)
+
+    def test_get_settings_aborted_change(self):
+        values = settings.get_settings()
+        api.portal.set_registry_record(
+            'filesizelimit', 1000, interface=IIconifiedCategorySettings)
+        # not cached while the change is pending
+        self.assertEqual(settings.get_settings().filesizelimit, 1000)
+        self.assertFalse(settings.get_settings() is settings.get_settings())
+        transaction.abort()
+        self.assertEqual(settings.get_settings().filesizelimit, values.filesizelimit)
+        # cached again
+        self.assertTrue(settings.get_settings() is settings.get_settings())
+
+    def test_get_settings_missing_record(self):
+        registry = getUtility(IRegistry)
+        del registry.records[settings.PREFIX + 'css_icons_mode']
+        # field default value
+        self.assertEqual(settings.get_settings().css_icons_mode, 'url')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import snapshot
+from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.tests.base import BaseTestCase
+from plone import api
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
+
+import transaction
+
+
+class TestCategoriesSnapshot(BaseTestCase):
+
+    def test_lookups(self):
+        config_snapshot = utils.get_categories_snapshot(self.portal)
+        category = self.config['group-1']['category-1-1']
+        subcategory = category['subcategory-1-1-1']
+        # 2 groups of 3 categories having 2 subcategories
+        self.assertEqual(len(config_snapshot), 18)
+
+        infos = config_snapshot.get(category.UID())
+        self.assertEqual(infos, config_snapshot.get_by_path(('group-1', 'category-1-1')))
+        self.assertEqual(infos.calculated_id, utils.calculate_category_id(category))
+        self.assertEqual(infos.title, 'Category 1-1')
+        self.assertFalse(infos.is_subcategory)
+        self.assertTrue(infos.to_be_printed_activated)
+        self.assertFalse(infos.confidentiality_activated)
+
+        sub_infos = config_snapshot.get(subcategory.UID())
+        self.assertTrue(sub_infos.is_subcategory)
+        self.assertEqual(sub_infos.category_uid, category.UID())
+        self.assertEqual(sub_infos.icon_url, infos.icon_url)
+        self.assertEqual(
+            sub_infos.basic_infos,
+            {'category_uid': category.UID(),
+             'category_id': 'category-1-1',
+             'category_title': 'Category 1-1',
+             'subcategory_uid': subcategory.UID(),
+             'subcategory_id': 'subcategory-1-1-1',
+             'subcategory_title': 'Subcategory 1-1-1',
+             'icon_url': infos.icon_url,
+             'to_be_printed_activated': True,
+             'confidentiality_activated': False,
+             'signed_activated': False,
+             'publishable_activated': False})
+        self.assertEqual(
+            utils.get_category_infos(self.portal, 'config_-_group-1_-_category-1-1'),
+            infos)
+        self.assertRaises(KeyError, utils.get_category_infos, self.portal, 'config_-_group-1_-_unknown')
+
+        # infos are immutable
+        self.assertRaises(AttributeError, setattr, infos, 'title', 'New title')
+
+    def test_group_flags_default(self):
+        """Like BaseView._may_set_values, a flag missing on the group
+           (a category stored in the config root) is True"""
+        category = self.config['group-1']['category-1-1']
+        infos = snapshot._category_infos(
+            category, category, self.config, ('category-1-1', ), 0, 0)
+        for name in snapshot.GROUP_FLAGS:
+            self.assertTrue(infos.basic_infos[name])
+        # flags of a group are stored
+        infos = utils.get_categories_snapshot(self.portal).get(category.UID())
+        self.assertTrue(infos.basic_infos['to_be_printed_activated'])
+        self.assertFalse(infos.basic_infos['signed_activated'])
+
+    def test_categories_order(self):
+        self.assertEqual(
+            [infos.uid for infos in utils.get_categories_infos(self.portal)],
+            [brain.UID for brain in utils.get_categories(self.portal)])
+        self.assertEqual(
+            utils.get_categories(self.portal, the_objects=True),
+            [brain.getObject() for brain in utils.get_categories(self.portal)])
+        category = self.config['group-1']['category-1-1']
+        self.assertEqual(
+            [infos.id for infos in utils.get_subcategories_infos(self.portal, category)],
+            ['subcategory-1-1-2', 'subcategory-1-1-1'])
+
+    def test_version(self):
+        category = self.config['group-1']['category-1-1']
+        version = snapshot.get_version(self.config)
+        transaction.commit()
+        config_snapshot = utils.get_categories_snapshot(self.portal)
+        # shared until the version changes
+        self.assertTrue(config_snapshot is utils.get_categories_snapshot(self.portal))
+
+        category.title = 'Category 1-1 modified'
+        notify(ObjectModifiedEvent(category))
+        self.assertEqual(snapshot.get_version(self.config), version + 1)
+        self.assertEqual(
+            utils.get_categories_snapshot(self.portal).get(category.UID()).title,
+            'Category 1-1 modified')
+        transaction.commit()
+        new_snapshot = utils.get_categories_snapshot(self.portal)
+        self.assertFalse(new_snapshot is config_snapshot)
+        self.assertEqual(new_snapshot.version, version + 1)
+        self.assertEqual(new_snapshot.get(category.UID()).title, 'Category 1-1 modified')
+
+        # adding a category bumps the version
+        new_category = api.content.create(
+            type='ContentCategory',
+            title='Category X',
+            icon=self.icon,
+            container=self.config['group-1'],
+        )
+        self.assertTrue(snapshot.get_version(self.config) > version + 1)
+        self.assertTrue(new_category.UID() in utils.get_categories_snapshot(self.portal))
+        # removing it too
+        version = snapshot.get_version(self.config)
+        api.content.delete(new_category)
+        self.assertTrue(snapshot.get_version(self.config) > version)
+        self.assertFalse(new_category.UID() in utils.get_categories_snapshot(self.portal))
+
+    def test_version_bumped_on_commit(self):
+        category = self.config['group-1']['category-1-1']
+        transaction.commit()
+        version = snapshot.get_version(self.config)
+        shared = utils.get_categories_snapshot(self.portal)
+
+        # modified without event, the version is bumped when committed
+        category.title = 'Category 1-1 modified'
+        self.assertEqual(snapshot.get_version(self.config), version)
+        transaction.commit()
+        self.assertEqual(snapshot.get_version(self.config), version + 1)
+        new_shared = utils.get_categories_snapshot(self.portal)
+        self.assertFalse(new_shared is shared)
+        self.assertEqual(new_shared.get(category.UID()).title, 'Category 1-1 modified')
+
+        # bumped once when an event already bumped it
+        category.title = 'Category 1-1'
+        notify(ObjectModifiedEvent(category))
+        transaction.commit()
+        self.assertEqual(snapshot.get_version(self.config), version + 2)
+
+    def test_modified_in_transaction(self):
+        category = self.config['group-1']['category-1-1']
+        transaction.commit()
+        shared = utils.get_categories_snapshot(self.portal)
+        self.assertIsNotNone(shared.key)
+
+        # modified without event, a private snapshot is built once
+        category.title = 'Category 1-1 modified'
+        private = utils.get_categories_snapshot(self.portal)
+        self.assertIsNone(private.key)
+        self.assertEqual(private.get(category.UID()).title, 'Category 1-1 modified')
+        self.assertTrue(utils.get_categories_snapshot(self.portal) is private)
+        # and built again after another change, savepoints do not matter
+        transaction.savepoint()
+        category.title = 'Category 1-1 modified again'
+        self.assertEqual(utils.get_categories_snapshot(self.portal).get(category.UID()).title,
+                         'Category 1-1 modified again')
+
+        # shared snapshot is used again in next transaction
+        transaction.abort()
+        self.assertTrue(utils.get_categories_snapshot(self.portal) is shared)
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from collections import OrderedDict
+from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from collective.iconifiedcategory.storage import CategorizedElementInfos
+from collective.iconifiedcategory.storage import CategorizedElements
+from collective.iconifiedcategory.storage import CategorizedElementsOrder
+from collective.iconifiedcategory.storage import ReadOnlyInfos
+from collective.iconifiedcategory.tests.base import BaseTestCase
+from persistent import Persistent
+from plone import api
+from plone.dexterity.utils import createContentInContainer
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
+
+import os
+import shutil
+import tempfile
+import threading
+import transaction
+import unittest
+import ZODB
+
+
+class Container(Persistent):
+    """A container storing categorized_elements"""
+
+
+def legacy_add(container, uid, infos):
+    # former behavior of update_categorized_elements
+    if 'categorized_elements' not in container.__dict__:
+        container.categorized_elements = OrderedDict()
+    container.categorized_elements[uid] = infos
+    container._p_changed = True
+
+
+def sorted_storage(uids):
+    elements = CategorizedElements([(uid, {'title': 'title'}) for uid in uids])
+    elements.set_order(uids, keys=dict([(uid, (uid, )) for uid in uids]))
+    return elements
+
+
+def storage_add(container, uid, infos):
+    container.categorized_elements.add(uid, infos, key=(uid, ))
+
+
+def storage_add_file(container, uid, infos):
+    # every elements are indexed under a new portal_type
+    storage_add(container, uid, dict(infos, portal_type='File'))
+
+
+def storage_update(container, uid, infos):
+    container.categorized_elements[uid].update(infos)
+
+
+class TestCategorizedElements(BaseTestCase):
+
+    def test_dict_api(self):
+        storage = CategorizedElements([('uid2', {'title': 'b'}),
+                                       ('uid1', {'title': 'a'})])
+        self.assertEqual(len(storage), 2)
+        self.assertEqual(storage.keys(), ['uid2', 'uid1'])
+        self.assertTrue('uid1' in storage)
+        self.assertFalse('uid3' in storage)
+        self.assertTrue(isinstance(storage['uid1'], CategorizedElementInfos))
+        self.assertEqual(storage.get('uid3', {}), {})
+        self.assertEqual(
+            storage,
+            OrderedDict([('uid2', {'title': 'b'}), ('uid1', {'title': 'a'})]))
+
+        # updating an element keeps the same record
+        record = storage['uid1']
+        storage['uid1'] = {'title': 'A'}
+        self.assertTrue(storage['uid1'] is record)
+        self.assertEqual(record, {'title': 'A'})
+
+        storage.set_order(['uid1', 'uid2'])
+        self.assertEqual([v['title'] for v in storage.values()], ['A', 'b'])
+        del storage['uid1']
+        self.assertEqual(storage.items(), [('uid2', {'title': 'b'})])
+        storage.clear()
+        self.assertEqual(storage, OrderedDict())
+        self.assertFalse(storage)
+
+    def test_move(self):
+        storage = CategorizedElements(
+            [(uid, {'title': uid}) for uid in ('c', 'a', 'e')])
+        # never sorted
+        self.assertFalse(storage.is_sorted(1))
+        storage.set_order(['a', 'c', 'e'], keys={'a': (0, 'a'), 'c': (0, 'c'), 'e': (1, 'e')}, version=1)
+        self.assertTrue(storage.is_sorted(1))
+        self.assertFalse(storage.is_sorted(2))
+        # a new element is appended then moved
+        storage['d'] = {'title': 'd'}
+        self.assertTrue(storage.is_sorted(1, uid='d'))
+        self.assertFalse(storage.is_sorted(1))
+        storage.move('d', (0, 'd'))
+        self.assertEqual(storage.keys(), ['a', 'c', 'd', 'e'])
+        # existing element moved
+        storage.move('a', (1, 'f'))
+        self.assertEqual(storage.keys(), ['c', 'd', 'e', 'a'])
+        # same key as another element
+        storage.move('c', (1, 'e'))
+        self.assertEqual(storage.keys(), ['d', 'e', 'c', 'a'])
+        del storage['e']
+        self.assertEqual(storage.keys(), ['d', 'c', 'a'])
+        self.assertTrue(storage.is_sorted(1))
+        # a new element is stored at its position
+        storage.add('b', {'title': 'b'}, key=(0, 'b'))
+        self.assertEqual(storage.keys(), ['b', 'd', 'c', 'a'])
+        self.assertTrue(storage.is_sorted(1))
+
+    def test_legacy_order(self):
+        storage = CategorizedElements(
+            [(uid, {'title': uid}) for uid in ('a', 'c', 'e')])
+        # order was stored in a list and a dict by former versions
+        order = storage._order = CategorizedElementsOrder()
+        del order._entries
+        order.__dict__.update(
+            {'uids': ['a', 'c', 'e'], 'keys': {'a': (0, 'a'), 'c': (0, 'c'), 'e': (1, 'e')},
+             'version': 1})
+        self.assertEqual(storage.keys(), ['a', 'c', 'e'])
+        self.assertEqual(storage.ordered(['e', 'a']), ['a', 'e'])
+        self.assertTrue(storage.is_sorted(1))
+        # converted when modified
+        storage.move('e', (0, 'b'))
+        self.assertFalse('uids' in order.__dict__)
+        self.assertEqual(storage.keys(), ['a', 'e', 'c'])
+        self.assertEqual(order.keys, {'a': (0, 'a'), 'c': (0, 'c'), 'e': (0, 'b')})
+        self.assertTrue(storage.is_sorted(1))
+
+    def test_sorted_add_write_set(self):
+        folder = api.content.create(container=self.portal, type='Folder', id='folder')
+        for idx in range(40):
+            createContentInContainer(
+                container=folder,
+                portal_type='Document',
+                title='doc{0:02d}'.format(idx),
+                content_category='config_-_group-1_-_category-1-1',
+                to_print=False,
+                confidential=False,
+            )
+        storage = folder.categorized_elements
+        order = storage._order
+        self.assertTrue(storage.is_sorted(utils._categories_version(folder)))
+        # changes are written in the savepoint, only next changes are tracked
+        transaction.savepoint()
+        document = createContentInContainer(
+            container=folder,
+            portal_type='Document',
+            title='a doc',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        self.assertEqual(storage.keys()[0], document.UID())
+        # neither the storage nor its whole order are written
+        self.assertFalse(storage._p_changed)
+        self.assertFalse(order._p_changed)
+        # state of a tree is its buckets separated by their first key
+        buckets = order._entries.__getstate__()[0][::2]
+        self.assertTrue(len(buckets) > 1)
+        self.assertEqual(len([bucket for bucket in buckets if bucket._p_changed]), 1)
+        transaction.abort()
+
+    def test_indexes(self):
+        storage = CategorizedElements(
+            [('uid1', {'category_uid': 'cat1', 'portal_type': 'File', 'to_print': True}),
+             ('uid2', {'category_uid': 'cat1', 'portal_type': 'Image', 'to_print': False}),
+             ('uid3', {'category_uid': 'cat2', 'portal_type': 'File', 'to_print': False})])
+        self.assertEqual(storage.search(category_uid='cat1'), set(['uid1', 'uid2']))
+        self.assertEqual(storage.search(category_uid='cat1', portal_type='File'), set(['uid1']))
+        self.assertEqual(storage.search(portal_type='Link'), set())
+        self.assertEqual(storage.count('to_print', False), 2)
+        self.assertEqual(storage.ordered(['uid3', 'uid1', 'unknown']), ['uid1', 'uid3'])
+        # records modified in place are reindexed when stored
+        infos = storage['uid1']
+        infos['portal_type'] = 'Image'
+        storage['uid1'] = infos
+        self.assertEqual(storage.search(portal_type='Image'), set(['uid1', 'uid2']))
+        self.assertEqual(storage.search(portal_type='File'), set(['uid3']))
+        del storage['uid2']
+        self.assertEqual(storage.search(category_uid='cat1'), set(['uid1']))
+        self.assertEqual(storage.count('portal_type', 'Image'), 1)
+
+    def test_legacy_indexes(self):
+        storage = CategorizedElements(
+            [('uid1', {'portal_type': 'File'}), ('uid2', {'portal_type': 'Image'})])
+        # indexed by value then uid by former versions
+        for name in storage._indexes.keys():
+            storage._indexes[name] = OOBTree()
+        storage._indexes['portal_type']['File'] = OOTreeSet(['uid1'])
+        storage._indexes['portal_type']['Image'] = OOTreeSet(['uid2'])
+        self.assertEqual(storage.search(portal_type='File'), set(['uid1']))
+        self.assertEqual(storage.count('portal_type', 'Image'), 1)
+        # indexed again when an element is stored
+        storage['uid3'] = {'portal_type': 'File'}
+        self.assertTrue(isinstance(storage._indexes['portal_type'], OOTreeSet))
+        self.assertEqual(storage.search(portal_type='File'), set(['uid1', 'uid3']))
+        self.assertEqual(storage.count('portal_type', 'Image'), 1)
+
+    def test_read_only_infos(self):
+        storage = CategorizedElements([('uid1', {'title': 'a', 'category_key': 'cat'})])
+        infos = ReadOnlyInfos(storage['uid1'], {'category_title': 'Category'})
+        self.assertEqual(
+            infos, {'title': 'a', 'category_key': 'cat', 'category_title': 'Category',
+                    'warn_filesize': False})
+
+        def set_title():
+            infos['title'] = 'b'
+        self.assertRaises(TypeError, set_title)
+        # copy() returns a modifiable copy
+        infos_copy = infos.copy()
+        infos_copy['title'] = 'b'
+        self.assertEqual(storage['uid1']['title'], 'a')
+        self.assertEqual(infos['title'], 'a')
+
+    def test_read_only_infos_warn_filesize(self):
+        # computed from the stored filesize and the current limit
+        storage = CategorizedElements([('uid1', {'filesize': 7000000, 'warn_filesize': False})])
+        infos = ReadOnlyInfos(storage['uid1'])
+        self.assertTrue(infos['warn_filesize'])
+        self.assertEqual(len(infos), 2)
+        api.portal.set_registry_record(
+            'filesizelimit', 8000000, interface=IIconifiedCategorySettings)
+        try:
+            self.assertFalse(infos['warn_filesize'])
+        finally:
+            api.portal.set_registry_record(
+                'filesizelimit', 5000000, interface=IIconifiedCategorySettings)
+
+    def test_records_written_separately(self):
+        document1 = createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc1',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc2',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        storage = self.portal.categorized_elements
+        self.assertTrue(isinstance(storage, CategorizedElements))
+        transaction.commit()
+
+        document1.to_print = True
+        category = utils.get_category_object(document1, document1.content_category)
+        utils.update_categorized_elements(self.portal, document1, category, sort=False)
+        self.assertTrue(storage[document1.UID()]._p_changed)
+        # neither the container nor the storage are written
+        self.assertFalse(self.portal._p_changed)
+        self.assertFalse(storage._p_changed)
+        self.assertTrue(storage[document1.UID()]['to_print'])
+        transaction.abort()
+
+    def test_migrate_ordered_dict(self):
+        document1 = createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc1',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        elements = OrderedDict(
+            [(uid, dict(infos)) for uid, infos in self.portal.categorized_elements.items()])
+        self.portal.categorized_elements = elements
+        # reading still works with a former OrderedDict
+        self.assertEqual(len(utils.get_categorized_elements(self.portal)), 1)
+        # it is migrated when written
+        storage = utils.get_categorized_elements_storage(self.portal)
+        self.assertTrue(isinstance(storage, CategorizedElements))
+        self.assertTrue(self.portal.categorized_elements is storage)
+        self.assertEqual(storage, elements)
+        utils.remove_categorized_element(self.portal, document1)
+        self.assertFalse(document1.UID() in storage)
+        api.content.delete(document1)
+
+    def test_normalized_records(self):
+        api.portal.set_registry_record(
+            'normalized_categorized_elements',
+            True,
+            interface=IIconifiedCategorySettings)
+        document1 = createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc1',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        category = self.config['group-1']['category-1-1']
+        record = self.portal.categorized_elements[document1.UID()]
+        self.assertEqual(record['category_key'], category.UID())
+        self.assertFalse('category_title' in record)
+        self.assertEqual(record['title'], 'doc1')
+        infos = utils.get_categorized_elements(self.portal)[0]
+        self.assertEqual(infos['category_uid'], category.UID())
+        self.assertEqual(infos['category_title'], 'Category 1-1')
+        self.assertEqual(
+            utils.get_categorized_element_infos(self.portal, document1.UID())['category_id'],
+            'category-1-1')
+
+        # editing the category does not need to update categorized elements
+        category.title = 'Category 1-1 renamed'
+        notify(ObjectModifiedEvent(category))
+        self.assertEqual(
+            utils.get_categorized_elements(self.portal)[0]['category_title'],
+            'Category 1-1 renamed')
+
+        # records are stored complete again when disabled
+        api.portal.set_registry_record(
+            'normalized_categorized_elements',
+            False,
+            interface=IIconifiedCategorySettings)
+        utils.update_all_categorized_elements(self.portal)
+        record = self.portal.categorized_elements[document1.UID()]
+        self.assertFalse('category_key' in record)
+        self.assertEqual(record['category_title'], 'Category 1-1 renamed')
+        api.content.delete(document1)
+
+
+class TestConcurrentWrites(unittest.TestCase):
+    """Several threads write the same container at the same time"""
+
+    threads_count = 5
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = ZODB.DB(FileStorage(os.path.join(self.tmpdir, 'Data.fs')))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _init(self, categorized_elements):
+        tm = transaction.TransactionManager()
+        connection = self.db.open(transaction_manager=tm)
+        container = connection.root()['container'] = Container()
+        container.categorized_elements = categorized_elements
+        tm.commit()
+        connection.close()
+
+    def _run(self, write):
+        """Every thread loads the container, waits that others did the same,
+           writes an element and commits.  Return the number of conflicts."""
+        conflicts = []
+        lock = threading.Lock()
+        loaded = threading.Semaphore(0)
+        go = threading.Event()
+
+        def worker(idx):
+            tm = transaction.TransactionManager()
+            connection = self.db.open(transaction_manager=tm)
+            try:
+                container = connection.root()['container']
+                write(container, 'uid{0}'.format(idx), {'title': 'title{0}'.format(idx)})
+                loaded.release()
+                go.wait()
+                with lock:
+                    try:
+                        tm.commit()
+                    except ConflictError:
+                        tm.abort()
+                        conflicts.append(idx)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(idx, ))
+                   for idx in range(self.threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            loaded.acquire()
+        go.set()
+        for thread in threads:
+            thread.join()
+        return len(conflicts)
+
+    def _elements(self):
+        connection = self.db.open()
+        try:
+            elements = connection.root()['container'].categorized_elements
+            return [(uid, dict(infos)) for uid, infos in elements.items()]
+        finally:
+            connection.close()
+
+    def test_legacy_conflicts(self):
+        self._init(OrderedDict())
+        # only the first transaction commits
+        self.assertEqual(self._run(legacy_add), self.threads_count - 1)
+        self.assertEqual(len(self._elements()), 1)
+
+    def test_add_without_conflict(self):
+        self._init(sorted_storage(['uid']))
+        self.assertEqual(self._run(storage_add), 0)
+        # every elements are stored and order is kept
+        self.assertEqual(
+            [uid for uid, infos in self._elements()],
+            ['uid', 'uid0', 'uid1', 'uid2', 'uid3', 'uid4'])
+
+    def test_add_new_index_value_without_conflict(self):
+        self._init(sorted_storage(['uid']))
+        # 'File' is indexed for the first time by every transaction
+        self.assertEqual(self._run(storage_add_file), 0)
+        connection = self.db.open()
+        try:
+            elements = connection.root()['container'].categorized_elements
+            self.assertEqual(
+                elements.search(portal_type='File'),
+                set(['uid{0}'.format(idx) for idx in range(self.threads_count)]))
+            self.assertEqual(elements.count('portal_type', None), 1)
+        finally:
+            connection.close()
+
+    def test_update_without_conflict(self):
+        self._init(CategorizedElements(
+            [('uid{0}'.format(idx), {'title': 'old', 'to_print': False})
+             for idx in range(self.threads_count)]))
+        self.assertEqual(self._run(storage_update), 0)
+        self.assertEqual(
+            self._elements(),
+            [('uid{0}'.format(idx), {'title': 'title{0}'.format(idx), 'to_print': False})
+             for idx in range(self.threads_count)])
+
+    def test_update_same_element(self):
+        self._init(CategorizedElements([('uid', {'title': 'old', 'to_print': False})]))
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        connection1 = self.db.open(transaction_manager=tm1)
+        connection2 = self.db.open(transaction_manager=tm2)
+        record1 = connection1.root()['container'].categorized_elements['uid']
+        record2 = connection2.root()['container'].categorized_elements['uid']
+        record1['title'] = 'new'
+        record2['to_print'] = True
+        tm1.commit()
+        # different fields are merged
+        tm2.commit()
+        record1['title'] = 'new1'
+        record2['title'] = 'new2'
+        tm1.commit()
+        # same field modified differently
+        self.assertRaises(ConflictError, tm2.commit)
+        tm2.abort()
+        connection1.close()
+        connection2.close()
+        self.assertEqual(self._elements(), [('uid', {'title': 'new1', 'to_print': True})])
@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
 
+from Acquisition import aq_base
 from collections import OrderedDict
 from collective.documentviewer.config import CONVERTABLE_TYPES
 from collective.documentviewer.settings import GlobalSettings
 from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.browser.actionview import ToPrintChangeView
 from collective.iconifiedcategory.browser.tabview import CategorizedContent
+from collective.iconifiedcategory.browser.tabview import CategorizedTable
 from collective.iconifiedcategory.browser.tabview import PrintColumn
+from collective.iconifiedcategory.interfaces import ICollectiveIconifiedCategoryLayer
+from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
 from collective.iconifiedcategory.tests.base import BaseTestCase
 from plone import api
 from Products.CMFCore.permissions import ModifyPortalContent
 from zope.event import notify
+from zope.interface import Interface
 from zope.lifecycleevent import ObjectModifiedEvent
 
+import transaction
+
+
+class NotEditableToPrintChangeView(ToPrintChangeView):
+
+    def _may_set_values(self, values):
+        return False
+
 
 class TestCategorizedTabView(BaseTestCase):
 
@@ -34,6 +48,28 @@ class TestCategorizedTabView(BaseTestCase):
         self.assertEqual(self.portal.categorized_elements, OrderedDict())
         self.assertTrue('No element to display.' in view())
 
+    def test_table_render_elements_not_loaded(self):
+        """Elements are rendered from the stored informations, when viewable
+           elements are computed from the stored security too, elements are
+           not loaded from the ZODB"""
+        api.portal.set_registry_record(
+            'view_from_stored_security', True, interface=IIconifiedCategorySettings)
+        transaction.commit()
+        try:
+            annexes = [aq_base(self.portal['file_txt']), aq_base(self.portal['image'])]
+            for annex in annexes:
+                annex._p_deactivate()
+            self.assertEqual([annex._p_changed for annex in annexes], [None, None])
+            result = self.portal.restrictedTraverse('@@iconifiedcategory')()
+            self.assertTrue('<a href="http://nohost/plone/file_txt" ' in result)
+            self.assertTrue('<a href="http://nohost/plone/image" ' in result)
+            # still ghosts
+            self.assertEqual([annex._p_changed for annex in annexes], [None, None])
+        finally:
+            api.portal.set_registry_record(
+                'view_from_stored_security', False, interface=IIconifiedCategorySettings)
+            transaction.commit()
+
     def test_table_render_special_chars(self):
         """Special chars used in :
            - element's title;
@@ -94,6 +130,101 @@ class TestCategorizedTabView(BaseTestCase):
         self.assertTrue('<a href="http://nohost/plone/image" ' in result)
         self.assertTrue('<a href="http://nohost/plone/file_txt/documentviewer#document/p1" ' in result)
 
+    def test_categorized_content_stored_infos(self):
+        file_obj = self.portal['file_txt']
+        infos = utils.get_categorized_elements(self.portal, uids=[file_obj.UID()])[0]
+        content = CategorizedContent(self.portal, infos)
+        self.assertEqual(content.Description, 'File description')
+        self.assertEqual(content.Creator, 'adminuser')
+        self.assertEqual(content.created, file_obj.created())
+        self.assertEqual(content.modified, file_obj.modified())
+        # the element was not loaded
+        self.assertIsNone(getattr(content, 'obj', None))
+        # by default, the permission is checked on the element
+        infos['modifyRolesAndUsers'] = ['user:someone']
+        self.assertTrue(content.can_modify())
+        self.assertEqual(content.obj, file_obj)
+        # from the stored security when enabled
+        api.portal.set_registry_record(
+            'view_from_stored_security', True, interface=IIconifiedCategorySettings)
+        try:
+            content = CategorizedContent(self.portal, infos)
+            self.assertFalse(content.can_modify())
+            infos['modifyRolesAndUsers'] = \
+                self.portal.categorized_elements[file_obj.UID()]['modifyRolesAndUsers']
+            self.assertTrue(content.can_modify())
+            self.assertIsNone(getattr(content, 'obj', None))
+        finally:
+            api.portal.set_registry_record(
+                'view_from_stored_security', False, interface=IIconifiedCategorySettings)
+
+        # elements stored without these informations
+        for key in ('description', 'creator', 'created', 'modified', 'modifyRolesAndUsers'):
+            del infos[key]
+        content = CategorizedContent(self.portal, infos)
+        self.assertEqual(content.Creator, 'adminuser')
+        self.assertTrue(content.can_modify())
+        self.assertEqual(content.getObject(), file_obj)
+
+    def test_table_is_editable(self):
+        table = CategorizedTable(self.portal, self.portal.REQUEST)
+        contents = [CategorizedContent(self.portal, infos) for infos in
+                    utils.get_categorized_elements(self.portal)]
+        self.assertEqual(len(contents), 2)
+        for content in contents:
+            self.assertTrue(table.is_editable(content, 'to_be_printed_activated'))
+            self.assertFalse(table.is_editable(content, 'signed_activated'))
+        # computed once for the category, permission checked on elements
+        self.assertEqual(len(table._category_flags), 1)
+        self.assertEqual(table._may_modify, {})
+
+        # from the stored security when enabled
+        api.portal.set_registry_record(
+            'view_from_stored_security', True, interface=IIconifiedCategorySettings)
+        try:
+            table.update()
+            contents = [CategorizedContent(self.portal, infos) for infos in
+                        utils.get_categorized_elements(self.portal)]
+            # same roles and users in another order
+            contents[1]._metadata['modifyRolesAndUsers'] = list(
+                reversed(contents[1]._metadata['modifyRolesAndUsers']))
+            for content in contents:
+                self.assertTrue(table.is_editable(content, 'to_be_printed_activated'))
+            # computed once for the roles and users profile
+            self.assertEqual(len(table._may_modify), 1)
+            # elements were not loaded
+            self.assertEqual([getattr(content, 'obj', None) for content in contents],
+                             [None, None])
+        finally:
+            api.portal.set_registry_record(
+                'view_from_stored_security', False, interface=IIconifiedCategorySettings)
+
+        # computed again when the table is updated
+        table.update()
+        self.assertEqual(table._category_flags, {})
+        self.assertEqual(table._may_modify, {})
+
+    def test_table_is_editable_customized_view(self):
+        table = CategorizedTable(self.portal, self.portal.REQUEST)
+        column = PrintColumn(self.portal, self.portal.REQUEST, table)
+        content = CategorizedContent(
+            self.portal, utils.get_categorized_elements(self.portal)[0])
+        self.assertTrue(table.uses_base_may_set_values(column.action_view))
+        self.assertTrue(column.is_editable(content))
+
+        # the action view overrides _may_set_values, it is used
+        sm = self.portal.getSiteManager()
+        required = (Interface, ICollectiveIconifiedCategoryLayer)
+        sm.registerAdapter(NotEditableToPrintChangeView, required, Interface,
+                           name=column.action_view)
+        try:
+            table.update()
+            self.assertFalse(table.uses_base_may_set_values(column.action_view))
+            self.assertFalse(column.is_editable(content))
+        finally:
+            sm.unregisterAdapter(NotEditableToPrintChangeView, required, Interface,
+                                 name=column.action_view)
+
     def test_PrintColumn(self):
         table = self.portal.restrictedTraverse('@@iconifiedcategory')
         file_infos = utils.get_categorized_elements(
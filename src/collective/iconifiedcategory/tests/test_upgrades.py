@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from collective.iconifiedcategory import upgrades
+from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.tests.base import BaseTestCase
+
+
+class TestUpgrades(BaseTestCase):
+
+    def test_process_paths(self):
+        paths = list(utils.iter_brains_paths(
+            portal_type=['File', 'Image'], path='/'.join(self.portal.getPhysicalPath())))
+        paths.append('/plone/unknown')
+        self.assertEqual(len(paths), 3)
+        processed = []
+        upgrades.process_paths('test', paths, lambda obj: processed.append(obj.getId()),
+                               batch_size=1)
+        self.assertEqual(processed, ['file_txt', 'image'])
+        # already done
+        upgrades.process_paths('test', paths, lambda obj: processed.append(obj.getId()))
+        self.assertEqual(processed, ['file_txt', 'image'])
+
+        # resumed after the last committed object
+        processed = []
+        upgrades.clear_checkpoints('test')
+        upgrades._checkpoints()['test'] = '/'.join(self.portal['file_txt'].getPhysicalPath())
+        upgrades.process_paths('test', paths, lambda obj: processed.append(obj.getId()))
+        self.assertEqual(processed, ['image'])
+        upgrades.clear_checkpoints('test')
+        self.assertFalse('test' in upgrades._checkpoints())
+
+    def test_upgrade_to_2110(self):
+        uid = self.portal['file_txt'].UID()
+        self.portal.categorized_elements[uid]['warn_filesize'] = True
+        upgrades.upgrade_to_2110(None)
+        self.assertFalse('warn_filesize' in self.portal.categorized_elements[uid])
+        # still available when categorized elements are read
+        infos = utils.get_categorized_elements(self.portal, uids=[uid])[0]
+        self.assertFalse(infos['warn_filesize'])
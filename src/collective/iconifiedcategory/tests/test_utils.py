@@ -8,12 +8,25 @@ Created by mpeeters
 """
 
 from collections import OrderedDict
+from collective.iconifiedcategory import stats
 from collective.iconifiedcategory import utils
+from collective.iconifiedcategory.adapter import CategorizedElementsFilterAdapter
 from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
+from collective.iconifiedcategory.interfaces import IIconifiedContentFilter
 from collective.iconifiedcategory.tests.base import BaseTestCase
 from plone import api
+from plone import namedfile
+from plone.app.testing import login
+from plone.app.testing import logout
 from plone.dexterity.utils import createContentInContainer
+from Products.CMFCore.WorkflowCore import ActionSucceededEvent
 from zExceptions import Redirect
+from zope.component import getGlobalSiteManager
+from zope.event import notify
+from zope.interface import Interface
+from zope.lifecycleevent import ObjectModifiedEvent
+from zope.publisher.interfaces.browser import IBrowserRequest
+import os
 import transaction
 
 
@@ -116,6 +129,36 @@ class TestUtils(BaseTestCase):
         api.content.delete(subcategory)
         api.content.delete(category)
 
+    def test_count_relations(self):
+        category = self.config['group-1']['category-1-1']
+        subcategory = category['subcategory-1-1-1']
+        self.assertFalse(utils.has_relations(category))
+        for idx in range(2):
+            api.content.create(
+                type='Document',
+                id='doc-{0}'.format(idx),
+                container=self.portal,
+                content_category='config_-_group-1_-_category-1-1',
+            )
+        self.assertEqual(
+            utils.count_relations([category.UID(), subcategory.UID()]),
+            {category.UID(): 2, subcategory.UID(): 0})
+        self.assertTrue(utils.has_relations(category))
+        self.assertFalse(utils.has_relations(subcategory))
+        api.content.create(
+            type='Document',
+            id='doc-2',
+            container=self.portal,
+            content_category='config_-_group-1_-_category-1-1_-_subcategory-1-1-1',
+        )
+        self.assertTrue(utils.has_relations(subcategory))
+        usage = utils.get_categories_usage(self.config)
+        self.assertEqual(usage[category.UID()], 2)
+        self.assertEqual(usage[subcategory.UID()], 1)
+        self.assertEqual(usage[self.config['group-1']['category-1-2'].UID()], 0)
+        for idx in range(3):
+            api.content.delete(self.portal['doc-{0}'.format(idx)])
+
     def test_category_moved(self):
         """
         Ensure that an error is raised if we try to move an used category
@@ -202,6 +245,54 @@ class TestUtils(BaseTestCase):
         api.content.delete(subcategory)
         api.content.delete(category)
 
+    def test_query_config_root_cache(self):
+        """Config root lookup is cached for the duration of the request."""
+        utils.invalidate_config_root_cache()
+        stats.reset('config_root_lookups_saved')
+        self.assertEqual(utils.query_config_root(self.portal), self.config)
+        self.assertEqual(stats.get('config_root_lookups_saved'), 0)
+        self.assertEqual(utils.query_config_root(self.portal), self.config)
+        self.assertEqual(utils.get_config_root(self.portal), self.config)
+        self.assertEqual(stats.get('config_root_lookups_saved'), 2)
+        # removing the config invalidates the cache
+        api.content.delete(self.config)
+        self.assertIsNone(utils.query_config_root(self.portal))
+        self.assertFalse(utils.has_config_root(self.portal))
+        # adding a config invalidates the cache
+        config = api.content.create(
+            type='ContentCategoryConfiguration',
+            title='New config',
+            container=self.portal,
+        )
+        self.assertEqual(utils.query_config_root(self.portal), config)
+
+    def test_get_ordered_categories(self):
+        transaction.commit()
+        ordered = utils.get_ordered_categories(self.portal)
+        brains = utils.get_categories(self.portal)
+        # uid and calculated id of 6 categories and 12 subcategories
+        self.assertEqual(len(ordered), 2 * 18)
+        for idx, brain in enumerate(brains):
+            category = brain.getObject()
+            self.assertEqual(ordered[brain.UID], idx)
+            self.assertEqual(ordered[utils.calculate_category_id(category)], idx)
+            for subcategory in category.objectValues():
+                self.assertEqual(ordered[subcategory.UID()], idx)
+                self.assertEqual(ordered[utils.calculate_category_id(subcategory)], idx)
+        # cache key only depends on the configuration version
+        key = utils.get_ordered_categories_cachekey(None, self.portal)
+        self.assertEqual(key, utils.get_ordered_categories_cachekey(None, self.portal['config']))
+        self.assertTrue(utils.get_ordered_categories(self.portal) is ordered)
+        # when configuration is changed, key changes
+        category = self.config['group-1']['category-1-1']
+        category.enabled = False
+        notify(ObjectModifiedEvent(category))
+        transaction.commit()
+        self.assertNotEqual(key, utils.get_ordered_categories_cachekey(None, self.portal))
+        self.assertFalse(category.UID() in utils.get_ordered_categories(self.portal))
+        category.enabled = True
+        notify(ObjectModifiedEvent(category))
+
     def test_calculate_filesize(self):
         self.assertEqual('100 B', utils.calculate_filesize(100))
         self.assertEqual('1 KB', utils.calculate_filesize(1024))
@@ -268,17 +359,23 @@ class TestUtils(BaseTestCase):
             'filesizelimit',
             interface=IIconifiedCategorySettings,
             value=3000)
-        file2 = api.content.create(
-            id='file2',
-            type='File',
-            file=self.file,
-            container=self.portal,
-            content_category='config_-_group-1_-_category-1-1',
-            to_print=False,
-            confidential=False,
-        )
-        self.assertEqual(file2.file.size, 3017)
-        self.assertTrue(utils.warn_filesize(file2.file.size))
+        try:
+            file2 = api.content.create(
+                id='file2',
+                type='File',
+                file=self.file,
+                container=self.portal,
+                content_category='config_-_group-1_-_category-1-1',
+                to_print=False,
+                confidential=False,
+            )
+            self.assertEqual(file2.file.size, 3017)
+            self.assertTrue(utils.warn_filesize(file2.file.size))
+        finally:
+            api.portal.set_registry_record(
+                'filesizelimit',
+                interface=IIconifiedCategorySettings,
+                value=5000000)
 
     def test_render_filesize(self):
         self.assertEqual(utils.render_filesize(1000),
@@ -324,11 +421,16 @@ class TestUtils(BaseTestCase):
               'category_uid': category.UID(),
               'confidential': False,
               'confidentiality_activated': False,
+              'created': document.created(),
+              'creator': 'adminuser',
               'description': 'Document description',
               'download_url': None,
               'filesize': None,
               'icon_url': u'config/group-1/category-x/@@images/{0}'.format(scale),
               'id': 'doc-subcategory-move',
+              'modified': document.modified(),
+              'modifyRolesAndUsers': self.portal.categorized_elements[
+                  document.UID()]['modifyRolesAndUsers'],
               'portal_type': 'Document',
               'preview_status': 'not_convertable',
               'publishable': False,
@@ -404,6 +506,73 @@ class TestUtils(BaseTestCase):
         api.content.delete(document2)
         api.content.delete(category)
 
+    def test_get_positions_in_parent(self):
+        folder = api.content.create(id='folder', type='Folder', container=self.portal)
+        for id in ('doc1', 'doc2', 'doc3'):
+            api.content.create(id=id, type='Document', container=folder)
+        folder.moveObjectsToTop(['doc3'])
+        self.assertEqual(
+            utils.get_positions_in_parent(folder, ['doc1', 'doc3']),
+            {'doc3': 0, 'doc1': 1})
+        # containers without plone.folder ordering
+        self.assertEqual(
+            utils.get_positions_in_parent(self.portal, ['folder']),
+            {'folder': self.portal.objectIds().index('folder')})
+        api.content.delete(folder)
+
+    def test_get_current_user_tokens(self):
+        tokens = utils.get_current_user_tokens()
+        self.assertTrue(isinstance(tokens, frozenset))
+        self.assertTrue('user:adminuser' in tokens)
+        # computed once by request and user
+        self.assertTrue(utils.get_current_user_tokens() is tokens)
+        logout()
+        self.assertEqual(utils.get_current_user_tokens(), frozenset(['Anonymous']))
+        login(self.portal, 'adminuser')
+        self.assertTrue(utils.get_current_user_tokens() is tokens)
+
+    def test_get_categorized_elements_fast_path(self):
+        document = createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        uid = document.UID()
+        self.assertEqual(len(utils.get_categorized_elements(self.portal, uids=[uid])), 1)
+        # disabled by default, IIconifiedContent.can_view is used
+        self.portal.categorized_elements[uid]['allowedRolesAndUsers'] = ['user:someone']
+        self.assertEqual(len(utils.get_categorized_elements(self.portal, uids=[uid])), 1)
+        # viewable elements are computed from stored allowedRolesAndUsers
+        api.portal.set_registry_record(
+            'view_from_stored_security', True, interface=IIconifiedCategorySettings)
+        try:
+            self.assertEqual(utils.get_categorized_elements(self.portal, uids=[uid]), [])
+            # stored allowedRolesAndUsers is updated when security changes
+            notify(ActionSucceededEvent(document, None, 'publish', None))
+            self.assertEqual(
+                self.portal.categorized_elements[uid]['allowedRolesAndUsers'], ['Anonymous'])
+            self.assertEqual(len(utils.get_categorized_elements(self.portal, uids=[uid])), 1)
+
+            # fast path may be disabled, IIconifiedContent.can_view is then used
+            class NoFastPathFilter(CategorizedElementsFilterAdapter):
+                use_fast_path = False
+            gsm = getGlobalSiteManager()
+            gsm.registerAdapter(
+                NoFastPathFilter, (Interface, IBrowserRequest), IIconifiedContentFilter)
+            try:
+                self.portal.categorized_elements[uid]['allowedRolesAndUsers'] = ['user:someone']
+                self.assertEqual(len(utils.get_categorized_elements(self.portal, uids=[uid])), 1)
+            finally:
+                gsm.unregisterAdapter(
+                    NoFastPathFilter, (Interface, IBrowserRequest), IIconifiedContentFilter)
+        finally:
+            api.portal.set_registry_record(
+                'view_from_stored_security', False, interface=IIconifiedCategorySettings)
+        api.content.delete(document)
+
     def test_update_categorized_elements(self):
         document2 = createContentInContainer(
             container=self.portal,
@@ -499,6 +668,33 @@ class TestUtils(BaseTestCase):
         self.assertEqual(len(self.portal.categorized_elements), 1)
         self.assertTrue(document2UID in self.portal.categorized_elements)
 
+    def test_update_categorized_elements_unchanged(self):
+        document = createContentInContainer(
+            container=self.portal,
+            portal_type='Document',
+            title='doc1',
+            content_category='config_-_group-1_-_category-1-1',
+            to_print=False,
+            confidential=False,
+        )
+        category = utils.get_category_object(document, document.content_category)
+        record = self.portal.categorized_elements[document.UID()]
+        transaction.commit()
+        stats.reset('categorized_elements_writes_skipped')
+        # nothing changed, nothing is written
+        utils.update_categorized_elements(self.portal, document, category)
+        self.assertEqual(stats.get('categorized_elements_writes_skipped'), 1)
+        self.assertFalse(record._p_changed)
+        utils.update_all_categorized_elements(self.portal)
+        self.assertEqual(stats.get('categorized_elements_writes_skipped'), 2)
+        self.assertFalse(record._p_changed)
+        # changed infos are written
+        document.title = 'doc2'
+        utils.update_categorized_elements(self.portal, document, category)
+        self.assertEqual(stats.get('categorized_elements_writes_skipped'), 2)
+        self.assertTrue(record._p_changed)
+        self.assertEqual(record['title'], 'doc2')
+
     def test_get_category_icon_url(self):
         category = api.content.create(
             type='ContentCategory',
@@ -526,3 +722,15 @@ class TestUtils(BaseTestCase):
         category = subcategory.get_category()
         scale = category.restrictedTraverse('@@images').scale(scale='listing').__name__
         self.assertEqual(doc_icon_url, u'config/group-1/category-x/@@images/{0}'.format(scale))
+        # scale name is stored when the category is created
+        self.assertEqual(getattr(category, utils.ICON_SCALE_ATTR), scale)
+
+        # and updated when the icon is changed
+        icon = open(os.path.join(os.path.dirname(__file__), 'icône2.png'), 'r')
+        category.icon = namedfile.NamedBlobFile(icon.read(), filename=u'icône2.png')
+        transaction.commit()
+        notify(ObjectModifiedEvent(category))
+        new_scale = getattr(category, utils.ICON_SCALE_ATTR)
+        self.assertNotEqual(new_scale, scale)
+        self.assertEqual(utils.get_category_icon_url(subcategory),
+                         u'config/group-1/category-x/@@images/{0}'.format(new_scale))
@@ -83,7 +83,6 @@ class TestCategorizedChildInfosView(TestCategorizedChildView):
 
         # in case a file is too large, a warning is displayed
         # manipulate stored categorized_elements
-        self.portal.categorized_elements[self.portal['file_txt'].UID()]['warn_filesize'] = True
         self.portal.categorized_elements[self.portal['file_txt'].UID()]['filesize'] = 7000000
         self.viewinfos.update()
         self.assertTrue("(<span class=\'warn_filesize\' title=\'Annex size is huge, "
@@ -7,6 +7,7 @@ Created by mpeeters
 :license: GPL, see LICENCE.txt for more details.
 """
 
+from Products.CMFCore.permissions import View
 from zope.component import getUtility
 from zope.lifecycleevent import ObjectModifiedEvent
 from zope.event import notify
@@ -60,6 +61,18 @@ class TestVocabularies(unittest.TestCase):
         vocabulary = vocabulary(self.portal)
         self._check_category_vocabulary(vocabulary)
 
+    def test_category_vocabulary_restricted_subcategory(self):
+        subcategory = self.portal.config['group-1']['category-1-1']['subcategory-1-1-1']
+        subcategory.manage_permission(View, ['Manager'], acquire=False)
+        subcategory.reindexObjectSecurity()
+        vocabulary = getUtility(
+            IVocabularyFactory,
+            name='collective.iconifiedcategory.categories',
+        )
+        terms = [t.title for t in vocabulary(self.portal)]
+        self.assertFalse('Subcategory 1-1-1' in terms)
+        self.assertTrue('Subcategory 1-1-2' in terms)
+
     def test_category_vocabulary_use_category_uid_as_token(self):
         vocabulary = getUtility(
             IVocabularyFactory,
@@ -1,18 +1,101 @@
 # -*- coding: utf-8 -*-
+from bisect import bisect_right
 from collective.iconifiedcategory import logger
 from collective.iconifiedcategory.interfaces import IIconifiedInfos
+from collective.iconifiedcategory.utils import get_categorized_elements_storage
+from collective.iconifiedcategory.utils import iter_brains_paths
+from collective.iconifiedcategory.utils import store_icon_scale
 from collective.iconifiedcategory.utils import update_all_categorized_elements
 from plone import api
 from plone.dexterity.fti import DexterityFTI
 from Products.CMFPlone.utils import base_hasattr
+from persistent.mapping import PersistentMapping
 from Products.ZCatalog.ProgressHandler import ZLogHandler
+from zope.annotation.interfaces import IAnnotations
 from zope.component import getAdapter
 
+import time
 import transaction
 
 
 behavior_id = 'collective.iconifiedcategory.behaviors.iconifiedcategorization.IIconifiedCategorization'
 
+CHECKPOINTS_KEY = 'collective.iconifiedcategory.upgrades'
+
+# number of objects processed by transaction
+BATCH_SIZE = 1000
+
+
+class ThroughputLogHandler(ZLogHandler):
+    '''ZLogHandler also reporting the number of objects processed by second.'''
+
+    def init(self, ident, max):
+        self._started = time.time()
+        ZLogHandler.init(self, ident, max)
+
+    def report(self, current, *args, **kw):
+        if current > 0 and current % self._steps == 0:
+            elapsed = time.time() - self._started
+            self.info('{0}: {1:.1f} objects/s'.format(
+                self._ident, elapsed and current / elapsed or 0))
+        ZLogHandler.report(self, current, *args, **kw)
+
+
+def _checkpoints():
+    annotations = IAnnotations(api.portal.get())
+    if CHECKPOINTS_KEY not in annotations:
+        annotations[CHECKPOINTS_KEY] = PersistentMapping()
+    return annotations[CHECKPOINTS_KEY]
+
+
+def clear_checkpoints(*names):
+    '''Forget the progress of p_names, to call when an upgrade step is done.'''
+    checkpoints = _checkpoints()
+    for name in names:
+        checkpoints.pop(name, None)
+
+
+def process_paths(name, paths, handler, batch_size=BATCH_SIZE):
+    '''Call p_handler(obj) for the object at every path of p_paths, by path
+       order.  A transaction is committed every p_batch_size objects and the
+       ZODB cache is minimized so memory stays bounded.  Progress is stored
+       under p_name with every commit so a crashed run resumes after the last
+       committed object, call clear_checkpoints(p_name) when the upgrade step
+       is done.'''
+    portal = api.portal.get()
+    checkpoints = _checkpoints()
+    last = checkpoints.get(name)
+    if last is True:
+        logger.info('{0}: already done'.format(name))
+        return
+    paths = sorted(set(paths))
+    if last is not None:
+        paths = paths[bisect_right(paths, last):]
+        logger.info('{0}: resuming after {1}'.format(name, last))
+    pghandler = ThroughputLogHandler(steps=batch_size)
+    pghandler.init(name, len(paths))
+    for i, path in enumerate(paths, 1):
+        obj = portal.unrestrictedTraverse(path, None)
+        if obj is not None:
+            handler(obj)
+        pghandler.report(i)
+        if i % batch_size == 0:
+            checkpoints[name] = path
+            transaction.commit()
+            portal._p_jar.cacheMinimize()
+    checkpoints[name] = True
+    transaction.commit()
+    pghandler.finish()
+
+
+def _parent_path(path):
+    return path.rsplit('/', 1)[0]
+
+
+def _update_all_categorized_elements(parent):
+    # recompute everything including sorting
+    update_all_categorized_elements(parent)
+
 
 def _portal_types_using_behavior():
     ''' '''
@@ -37,62 +120,45 @@ def upgrade_to_2100(context):
 
     # get portal_types using IIconifiedCategorization behavior
     portal_types = _portal_types_using_behavior()
-    catalog = api.portal.get_tool('portal_catalog')
-    brains = catalog(portal_type=portal_types)
+    logger.info('Querying elements to update of portal_type "{0}"'.format(
+        ', '.join(portal_types)))
+    paths = list(iter_brains_paths(portal_type=portal_types))
 
-    logger.info('Querying elements to update among "{0}" objects of portal_type "{1}"'.format(
-        len(brains), ', '.join(portal_types)))
-    parents_to_update = []
-    for brain in brains:
-        obj = brain.getObject()
+    def set_attributes(obj):
         # this can be useless if using behavior 'Scan metadata' collective.dms.scanbehavior
         if not(base_hasattr(obj, 'to_sign')):
             setattr(obj, 'to_sign', False)
         if not(base_hasattr(obj, 'signed')):
             setattr(obj, 'signed', False)
 
-        parent = obj.aq_parent
-        if parent not in parents_to_update:
-            parents_to_update.append(parent)
-
+    process_paths('upgrade_to_2100_elements', paths, set_attributes)
     # finally update parents that contains categorized elements
-    nb_of_parents_to_update = len(parents_to_update)
-    i = 1
-    for parent_to_update in parents_to_update:
-        logger.info('Running update_all_categorized_elements for element {0}/{1} ({2})'.format(
-            i, nb_of_parents_to_update, '/'.join(parent_to_update.getPhysicalPath())))
-        i = i + 1
-        # recompute everything including sorting
-        update_all_categorized_elements(parent_to_update)
+    process_paths(
+        'upgrade_to_2100_parents',
+        set([_parent_path(path) for path in paths]),
+        _update_all_categorized_elements)
+    clear_checkpoints('upgrade_to_2100_elements', 'upgrade_to_2100_parents')
 
 
 def upgrade_to_2101(context):
     ''' '''
     # get portal_types using IIconifiedCategorization behavior
     portal_types = _portal_types_using_behavior()
-    catalog = api.portal.get_tool('portal_catalog')
-    brains = catalog(portal_type=portal_types)
+    logger.info('Querying elements to update of portal_type "{0}"'.format(
+        ', '.join(portal_types)))
+    paths = list(iter_brains_paths(portal_type=portal_types))
 
-    logger.info('Querying elements to update among "{0}" objects of portal_type "{1}"'.format(
-        len(brains), ', '.join(portal_types)))
-    parents_to_update = []
-    for brain in brains:
-        obj = brain.getObject()
+    def set_attributes(obj):
         if not(base_hasattr(obj, 'publishable')):
             setattr(obj, 'publishable', False)
 
-        parent = obj.aq_parent
-        if parent not in parents_to_update:
-            parents_to_update.append(parent)
-
+    process_paths('upgrade_to_2101_elements', paths, set_attributes)
     # finally update parents that contains categorized elements
-    nb_of_parents_to_update = len(parents_to_update)
-    i = 1
-    for parent_to_update in parents_to_update:
-        logger.info('Running update_all_categorized_elements for element {0}/{1} ({2})'.format(
-            i, nb_of_parents_to_update, '/'.join(parent_to_update.getPhysicalPath())))
-        i = i + 1
-        update_all_categorized_elements(parent_to_update)
+    process_paths(
+        'upgrade_to_2101_parents',
+        set([_parent_path(path) for path in paths]),
+        _update_all_categorized_elements)
+    clear_checkpoints('upgrade_to_2101_elements', 'upgrade_to_2101_parents')
 
 
 def upgrade_to_2102(context):
@@ -124,3 +190,89 @@ def upgrade_to_2102(context):
         parent.categorized_elements[obj.UID()]['allowedRolesAndUsers'] = allowedRolesAndUsers
         parent._p_changed = True
     pghandler.finish()
+
+
+def upgrade_to_2103(context):
+    '''Store categorized_elements in a CategorizedElements persistent storage
+       instead of an OrderedDict.'''
+    paths = iter_brains_paths(
+        object_provides='collective.iconifiedcategory.'
+        'behaviors.iconifiedcategorization.IIconifiedCategorizationMarker')
+    process_paths(
+        'upgrade_to_2103',
+        set([_parent_path(path) for path in paths]),
+        get_categorized_elements_storage)
+    clear_checkpoints('upgrade_to_2103')
+
+
+def upgrade_to_2104(context):
+    '''Add the 'normalized_categorized_elements' registry record.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'plone.app.registry')
+
+
+def upgrade_to_2105(context):
+    '''Add the 'categorized_elements_jobs_threshold' registry record.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'plone.app.registry')
+
+
+def upgrade_to_2106(context):
+    '''Store creator, creation and modification dates and modifyRolesAndUsers
+       in categorized_elements.'''
+    paths = iter_brains_paths(
+        object_provides='collective.iconifiedcategory.'
+        'behaviors.iconifiedcategorization.IIconifiedCategorizationMarker')
+    process_paths(
+        'upgrade_to_2106',
+        set([_parent_path(path) for path in paths]),
+        _update_all_categorized_elements)
+    clear_checkpoints('upgrade_to_2106')
+
+
+def upgrade_to_2107(context):
+    '''collective-iconifiedcategory.css is not merged by portal_css anymore.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'cssregistry')
+
+
+def upgrade_to_2108(context):
+    '''Add the 'css_icons_mode' registry record.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'plone.app.registry')
+
+
+def upgrade_to_2109(context):
+    '''Create the 'listing' scale of categories icon and store its name.'''
+    process_paths(
+        'upgrade_to_2109',
+        iter_brains_paths(object_provides='collective.iconifiedcategory.content.category.ICategory'),
+        store_icon_scale)
+    clear_checkpoints('upgrade_to_2109')
+
+
+def _drop_warn_filesize(parent):
+    # only records still storing it are written
+    for infos in get_categorized_elements_storage(parent).values():
+        if 'warn_filesize' in infos:
+            del infos['warn_filesize']
+
+
+def upgrade_to_2110(context):
+    '''warn_filesize is computed when categorized elements are read,
+       remove it from stored categorized_elements.'''
+    paths = iter_brains_paths(
+        object_provides='collective.iconifiedcategory.'
+        'behaviors.iconifiedcategorization.IIconifiedCategorizationMarker')
+    process_paths(
+        'upgrade_to_2110',
+        set([_parent_path(path) for path in paths]),
+        _drop_warn_filesize)
+    clear_checkpoints('upgrade_to_2110')
+
+
+def upgrade_to_2111(context):
+    '''Add the 'view_from_stored_security' registry record.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'plone.app.registry')
+
+
+def upgrade_to_2112(context):
+    '''collective-iconifiedcategory.css is linked by a viewlet, remove it
+       from portal_css.'''
+    context.runImportStepFromProfile('profile-collective.iconifiedcategory:default', 'cssregistry')
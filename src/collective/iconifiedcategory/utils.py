@@ -10,22 +10,32 @@ Created by mpeeters
 from Acquisition import aq_base
 from collections import OrderedDict
 from collective.iconifiedcategory import _
+from collective.iconifiedcategory import batch
+from collective.iconifiedcategory import cache
 from collective.iconifiedcategory import CAT_SEPARATOR
 from collective.iconifiedcategory import CSS_SEPARATOR
 from collective.iconifiedcategory import logger
+from collective.iconifiedcategory import stats
 from collective.iconifiedcategory.content.category import ICategory
 from collective.iconifiedcategory.content.categorygroup import ICategoryGroup
 from collective.iconifiedcategory.content.subcategory import ISubcategory
 from collective.iconifiedcategory.interfaces import IIconifiedCategoryConfig
 from collective.iconifiedcategory.interfaces import IIconifiedCategoryGroup
-from collective.iconifiedcategory.interfaces import IIconifiedCategorySettings
 from collective.iconifiedcategory.interfaces import IIconifiedContent
+from collective.iconifiedcategory.interfaces import IIconifiedContentFilter
 from collective.iconifiedcategory.interfaces import IIconifiedInfos
-from natsort import natsorted
+from collective.iconifiedcategory.settings import get_settings
+from collective.iconifiedcategory.snapshot import CATEGORY_INFOS_KEYS
+from collective.iconifiedcategory.snapshot import CategoryInfos
+from collective.iconifiedcategory.snapshot import get_snapshot
+from collective.iconifiedcategory.storage import CategorizedElements
+from collective.iconifiedcategory.storage import ReadOnlyInfos
+from natsort import natsort_keygen
 from plone import api
 from plone.app.contenttypes.interfaces import IFile
 from plone.app.contenttypes.interfaces import IImage
 from plone.memoize import ram
+from plone.memoize.volatile import DontCache
 from Products.CMFPlone.utils import safe_unicode
 from time import time
 from zope.component import getAdapter
@@ -35,15 +45,46 @@ from zope.globalrequest import getRequest
 from zope.i18n import translate
 from zope.interface import Invalid
 
-import copy
-
 
 def format_id_css(id):
     return id.replace(CAT_SEPARATOR, CSS_SEPARATOR)
 
 
+CONFIG_ROOT_CACHE = 'config_root'
+
+
+def _physical_path(context):
+    """Return the physical path of p_context or None if not available"""
+    getPhysicalPath = getattr(context, 'getPhysicalPath', None)
+    if getPhysicalPath is None:
+        return
+    try:
+        return getPhysicalPath()
+    except AttributeError:
+        return
+
+
 def query_config_root(context):
-    """Try to get the categories config root for the given context"""
+    """Try to get the categories config root for the given context.
+       Result is cached for the duration of the request (or transaction)
+       by physical path of the context."""
+    key = _physical_path(context)
+    if key is None:
+        return _query_config_root(context)
+    config_roots = cache.get_cache(CONFIG_ROOT_CACHE)
+    if key in config_roots:
+        stats.increment('config_root_lookups_saved')
+        return config_roots[key]
+    config_root = config_roots[key] = _query_config_root(context)
+    return config_root
+
+
+def invalidate_config_root_cache():
+    """Invalidate the config root lookups made during current request"""
+    cache.invalidate(CONFIG_ROOT_CACHE)
+
+
+def _query_config_root(context):
     adapter = queryAdapter(context, IIconifiedCategoryConfig)
     config_root = adapter and adapter.get_config() or None
     if not config_root and context is not None:
@@ -77,13 +118,70 @@ def get_group(config, context):
     return adapter.get_group()
 
 
+def get_categories_snapshot(context):
+    """Return the CategoriesSnapshot of the config root of given context"""
+    config_root = query_config_root(context)
+    if config_root is None:
+        return
+    return get_snapshot(config_root)
+
+
+def _group_path(context):
+    """Return the snapshot of given context and the path of the config group
+       relative to the config root (None if it could not be determined)"""
+    config_root = get_config_root(context)
+    config_group = get_group(config_root, context)
+    snapshot = get_categories_snapshot(context)
+    if snapshot is None:
+        return config_group, None, None
+    return config_group, snapshot, snapshot.relative_path(config_group)
+
+
+def get_categories_infos(context, only_enabled=True):
+    """Return the CategoryInfos of categories for a specific context,
+       ordered by position in parent"""
+    config_group, snapshot, group_path = _group_path(context)
+    if group_path is None:
+        infos = [snapshot.get(brain.UID) for brain in
+                 get_categories(context, only_enabled=only_enabled)]
+        return [category_infos for category_infos in infos if category_infos is not None]
+    return snapshot.categories(group_path, only_enabled=only_enabled)
+
+
+def get_subcategories_infos(context, category, only_enabled=True):
+    """Return the CategoryInfos of subcategories of given category
+       (a category object or CategoryInfos), ordered by position in parent.
+       Raise a ValueError if there is no config root for p_context."""
+    config_group, snapshot, group_path = _group_path(context)
+    return snapshot.subcategories(category.UID(), only_enabled=only_enabled)
+
+
+def get_category_infos(context, category_id):
+    """Return the CategoryInfos for given p_category_id
+       (content_category value), raise a KeyError if not found"""
+    config_group, snapshot, group_path = _group_path(context)
+    depth = 1
+    if ICategoryGroup.providedBy(config_group):
+        depth = 2
+    infos = None
+    if group_path is not None:
+        infos = snapshot.get_by_path(
+            group_path + tuple(category_id.split(CAT_SEPARATOR)[depth:]))
+    if infos is None:
+        raise KeyError(category_id)
+    return infos
+
+
 def get_categories(context,
                    the_objects=False,
                    only_enabled=True,
                    sort_on='getObjPositionInParent'):
     """Return the categories brains for a specific context"""
-    config_root = get_config_root(context)
-    config_group = get_group(config_root, context)
+    config_group, snapshot, group_path = _group_path(context)
+    if the_objects and sort_on == 'getObjPositionInParent' and group_path is not None:
+        # no need to query the catalog, use the snapshot
+        return [config_group.unrestrictedTraverse('/'.join(infos.path[len(group_path):]))
+                for infos in snapshot.categories(group_path, only_enabled=only_enabled)]
     catalog = api.portal.get_tool('portal_catalog')
     query = {
         'object_provides': 'collective.iconifiedcategory.content.category.ICategory',
@@ -100,6 +198,8 @@ def get_categories(context,
 
 def calculate_category_id(category):
     """Return the caculated category id for a category object"""
+    if isinstance(category, CategoryInfos):
+        return category.calculated_id
     if ICategory.providedBy(category):
         return '{0}-{1}_-_{2}_-_{3}'.format(
             category.aq_parent.aq_parent.aq_parent.id,
@@ -118,11 +218,14 @@ def calculate_category_id(category):
 
 
 def get_category_object(context, category_id):
-    config_root = get_config_root(context)
-    config_group = get_group(config_root, context)
+    config_group, snapshot, group_path = _group_path(context)
     depth = 1
     if ICategoryGroup.providedBy(config_group):
         depth = 2
+    if group_path is not None and snapshot.get_by_path(
+            group_path + tuple(category_id.split(CAT_SEPARATOR)[depth:])) is None:
+        # unknown category, no need to traverse the configuration
+        raise KeyError(category_id)
     category = config_group
     for path in category_id.split(CAT_SEPARATOR)[depth:]:
         category = category[path]
@@ -131,6 +234,28 @@ def get_category_object(context, category_id):
     return category
 
 
+# name of the 'listing' scale of the icon, stored on the category
+ICON_SCALE_ATTR = 'icon_scale_name'
+
+
+def _icon_scale_name(category):
+    # do not use restrictedTraverse or getMultiAdapter to get the "@@images" view
+    # because when used with plone.app.async, as there is no REQUEST, it fails.
+    from collective.iconifiedcategory.browser.views import ImageDataModifiedImageScaling
+    images = ImageDataModifiedImageScaling(category, getattr(category, 'REQUEST', {}))
+    scale = images.scale(scale='listing')
+    return scale.__name__
+
+
+def store_icon_scale(category):
+    """Create the 'listing' scale of the icon of given category and store
+       its name, used by get_category_icon_url"""
+    name = _icon_scale_name(category)
+    if getattr(aq_base(category), ICON_SCALE_ATTR, None) != name:
+        setattr(category, ICON_SCALE_ATTR, name)
+    return name
+
+
 def get_category_icon_url(category):
     portal_url = api.portal.get_tool('portal_url')
     if ICategory.providedBy(category):
@@ -138,15 +263,14 @@ def get_category_icon_url(category):
     else:
         obj = category.aq_parent
 
-    # do not use restrictedTraverse or getMultiAdapter to get the "@@images" view
-    # because when used with plone.app.async, as there is no REQUEST, it fails.
-    from collective.iconifiedcategory.browser.views import ImageDataModifiedImageScaling
-    images = ImageDataModifiedImageScaling(obj, getattr(obj, 'REQUEST', {}))
-    scale = images.scale(scale='listing')
+    name = getattr(aq_base(obj), ICON_SCALE_ATTR, None)
+    if name is None:
+        # scale name not stored yet, see store_icon_scale
+        name = _icon_scale_name(obj)
 
     return u'{0}/@@images/{1}'.format(
         portal_url.getRelativeContentURL(obj),
-        scale.__name__)
+        name)
 
 
 def update_categorized_elements(parent,
@@ -162,16 +286,20 @@ def update_categorized_elements(parent,
         - category : The category object
         - limited : Update only category related informations
         - logging : Enables logging
+    When updates are batched, the element is updated when the batch is flushed
     """
-    if 'categorized_elements' not in parent.__dict__:
-        parent.categorized_elements = OrderedDict()
+    updates = batch.get_batch()
+    if updates is not None:
+        updates.add(parent, obj, category, limited=limited, sort=sort, logging=logging)
+        return
+    storage = get_categorized_elements_storage(parent)
     uid, new_infos = get_categorized_infos(obj, category, limited=limited)
-    infos = parent.categorized_elements.get(uid, {})
-    infos.update(new_infos)
-    parent.categorized_elements[uid] = infos
-    parent._p_changed = True
-    if sort:
-        sort_categorized_elements(parent)
+    version = _categories_version(parent)
+    sort_key = sort and storage.is_sorted(version) and _element_sort_key(parent) or None
+    # a sorted element is stored at its position, it is not appended then moved
+    _store_infos(storage, uid, new_infos, sort_key=sort_key)
+    if sort and not storage.is_sorted(version):
+        sort_categorized_element(parent, uid)
     if logging:
         logger.info('Updated categorized elements of {0}'.format(
             obj.absolute_url_path()))
@@ -179,8 +307,17 @@ def update_categorized_elements(parent,
 
 def update_all_categorized_elements(container, limited=False, sort=True):
     # recompute everything if limited=False
-    if not limited:
-        container.categorized_elements = OrderedDict()
+    updates = batch.get_batch()
+    if updates is not None and not limited:
+        updates.add_container(container, sort=sort)
+        return
+    storage = get_categorized_elements_storage(container)
+    # the storage is kept and stale elements removed, this avoids
+    # conflicts with transactions updating other elements of container
+    stale_uids = set(storage.keys()) if not limited else set()
+    normalized = use_normalized_records()
+    version = _categories_version(container)
+    sort_key = sort and storage.is_sorted(version) and _element_sort_key(container) or None
     adapter = None
     for obj in container.objectValues():
         if hasattr(obj, 'content_category'):
@@ -194,62 +331,137 @@ def update_all_categorized_elements(container, limited=False, sort=True):
                 adapter.context = obj
                 adapter.obj = aq_base(obj)
             uid, new_infos = obj.UID(), adapter.get_infos(category, limited=limited)
-            infos = container.categorized_elements.get(uid, {})
-            infos.update(new_infos)
-            container.categorized_elements[uid] = infos
-    if container.categorized_elements and sort:
+            stale_uids.discard(uid)
+            _store_infos(storage, uid, new_infos,
+                         merge=limited, normalized=normalized, sort_key=sort_key)
+    for uid in stale_uids:
+        del storage[uid]
+    if storage and sort and not storage.is_sorted(version):
         sort_categorized_elements(container)
 
 
+def iter_brains_paths(**query):
+    """Stream the paths of catalog results, objects are not loaded"""
+    catalog = api.portal.get_tool('portal_catalog')
+    for brain in catalog.unrestrictedSearchResults(**query):
+        yield brain.getPath()
+
+
 def get_ordered_categories_cachekey(method, context, only_enabled=True):
-    """ """
-    # while using plone.app.async, there is not REQUEST
-    debug = 'no_request'
-    if hasattr(context, 'REQUEST'):
-        debug = str(context.REQUEST._debug)
-    return debug, get_config_root(context), only_enabled
+    """Cached by version of the categories configuration and config group,
+       not cached if the configuration is being modified"""
+    config_group, snapshot, group_path = _group_path(context)
+    if snapshot is None or snapshot.key is None:
+        raise DontCache
+    return snapshot.key, config_group.getPhysicalPath(), only_enabled
 
 
 @ram.cache(get_ordered_categories_cachekey)
 def get_ordered_categories(context, only_enabled=True):
-    """Return an ordered dict for categories (id and uids)"""
+    """Return a dict with position of categories and subcategories
+       (by UID and by calculated id)"""
+    config_group, snapshot, group_path = _group_path(context)
+    if snapshot is not None and snapshot.key is None:
+        # configuration modified in current transaction, not cached in RAM
+        memo_key = ('ordered_categories', config_group.getPhysicalPath(), only_enabled)
+        if memo_key not in snapshot.memo:
+            snapshot.memo[memo_key] = _get_ordered_categories(context, snapshot, only_enabled)
+        return snapshot.memo[memo_key]
+    return _get_ordered_categories(context, snapshot, only_enabled)
+
+
+def _get_ordered_categories(context, snapshot, only_enabled=True):
     elements = {}
     config_root = get_config_root(context)
     adapter = getMultiAdapter((config_root, context), IIconifiedCategoryGroup)
     categories = adapter.get_every_categories(only_enabled=only_enabled)
+    for idx, category in enumerate(categories):
+        infos = snapshot.get(category.UID)
+        if infos is None:
+            # category is not part of the config root of context
+            elements.update(_get_ordered_category(category, idx, only_enabled))
+            continue
+        elements[infos.uid] = idx
+        elements[infos.calculated_id] = idx
+        for subcategory in snapshot.subcategories(infos.uid, only_enabled=only_enabled):
+            elements[subcategory.uid] = idx
+            elements[subcategory.calculated_id] = idx
+    return elements
+
+
+def _get_ordered_category(category, idx, only_enabled=True):
+    """Return positions for a category brain and it's subcategories"""
+    elements = {}
     query = {}
     query['object_provides'] = 'collective.iconifiedcategory.content.subcategory.ISubcategory'
     if only_enabled:
         query['enabled'] = True
-    for idx, category in enumerate(categories):
-        elements[category.UID] = idx
-        elements[calculate_category_id(category.getObject())] = idx
-        subcategories = api.content.find(context=category, **query)
-        for subcategory in subcategories:
-            elements[subcategory.UID] = idx
-            elements[calculate_category_id(subcategory.getObject())] = idx
+    elements[category.UID] = idx
+    elements[calculate_category_id(category.getObject())] = idx
+    subcategories = api.content.find(context=category, **query)
+    for subcategory in subcategories:
+        elements[subcategory.UID] = idx
+        elements[calculate_category_id(subcategory.getObject())] = idx
     return elements
 
 
+def _categories_version(context):
+    snapshot = get_categories_snapshot(context)
+    return snapshot.version if snapshot is not None else None
+
+
+def _sort_key(context):
+    """Return the function computing the sort key of an element infos"""
+    ordered_categories = get_ordered_categories(context, only_enabled=False)
+    # use a natural sort on a lowered title so it mixes uppercase and lowercase titles
+    return natsort_keygen(
+        key=lambda infos: (ordered_categories[infos['category_uid']],
+                           safe_unicode(infos['title'].lower()),),
+    )
+
+
+def _element_sort_key(context):
+    """Return the function computing the sort key of the stored infos
+       of an element of p_context"""
+    sort_key = _sort_key(context)
+    snapshot = get_categories_snapshot(context)
+    return lambda infos: sort_key(_join_category_infos(infos, snapshot))
+
+
 def sort_categorized_elements(context):
     """Sort the categorized elements on an object"""
-    ordered_categories = get_ordered_categories(context, only_enabled=False)
-    # use realsorted on a lowered title so it mixes uppercase and lowercase titles
+    storage = get_categorized_elements_storage(context)
+    sort_key = _element_sort_key(context)
     try:
-        elements = natsorted(
-            context.categorized_elements.items(),
-            key=lambda x: (ordered_categories[x[1]['category_uid']],
-                           safe_unicode(x[1]['title'].lower()),),
-        )
+        keys = dict([(uid, sort_key(infos)) for uid, infos in storage.items()])
+    except KeyError:
+        return
+    # sort keys are stored so an element may be moved without sorting
+    # every elements and the order may be computed when resolving conflicts
+    storage.set_order(sorted(storage.keys(), key=keys.get),
+                      keys=keys,
+                      version=_categories_version(context))
+
+
+def sort_categorized_element(context, uid):
+    """Move the categorized element p_uid to its position, every elements
+       are sorted if categories changed since last sort"""
+    storage = get_categorized_elements_storage(context)
+    if not storage.is_sorted(_categories_version(context), uid=uid):
+        return sort_categorized_elements(context)
+    try:
+        key = _element_sort_key(context)(storage[uid])
     except KeyError:
         return
-    context.categorized_elements = OrderedDict([(k, v) for k, v in elements])
-    context._p_changed = True
+    storage.move(uid, key)
 
 
 def remove_categorized_element(parent, obj):
-    if obj.UID() in getattr(parent, 'categorized_elements', OrderedDict()):
-        del parent.categorized_elements[obj.UID()]
+    updates = batch.get_batch()
+    if updates is not None:
+        updates.discard(parent, obj.UID())
+    if obj.UID() in getattr(aq_base(parent), 'categorized_elements', {}):
+        del get_categorized_elements_storage(parent)[obj.UID()]
 
 
 def get_categorized_infos(obj, category, limited=False):
@@ -257,11 +469,122 @@ def get_categorized_infos(obj, category, limited=False):
     return obj.UID(), adapter.get_infos(category, limited=limited)
 
 
+def get_categorized_elements_storage(container):
+    """Return the CategorizedElements storage of p_container, it is created
+       if necessary and a former OrderedDict is migrated"""
+    storage = getattr(aq_base(container), 'categorized_elements', None)
+    if not isinstance(storage, CategorizedElements):
+        storage = CategorizedElements((storage or {}).items())
+        container.categorized_elements = storage
+    return storage
+
+
+def use_normalized_records():
+    """Are categorized elements stored normalized?"""
+    return get_settings().normalized_categorized_elements
+
+
+def _normalize_infos(infos):
+    """Replace the category informations of p_infos by a reference
+       to the category or subcategory, it is joined when infos are read.
+       category_uid is kept as it is indexed."""
+    category_key = infos.get('subcategory_uid') or infos.get('category_uid')
+    if category_key is None:
+        return
+    for key in CATEGORY_INFOS_KEYS:
+        if key != 'category_uid':
+            infos.pop(key, None)
+    infos['category_key'] = category_key
+
+
+def _store_infos(storage, uid, new_infos, merge=True, normalized=None, sort_key=None):
+    """Store p_new_infos of element p_uid in p_storage, updating
+       stored infos if p_merge is True.  Nothing is written if stored infos
+       do not change, return True if infos were written.
+       Written element is moved to its position if p_sort_key, the function
+       computing the sort key of stored infos, is given"""
+    stored = storage.get(uid)
+    infos = merge and stored is not None and dict(stored) or {}
+    infos.update(new_infos)
+    # computed when infos are read, see storage.COMPUTED
+    infos.pop('warn_filesize', None)
+    if normalized is None:
+        normalized = use_normalized_records()
+    if normalized:
+        _normalize_infos(infos)
+    elif 'category_key' in infos and 'category_uid' in infos:
+        # stored normalized before, infos are complete now
+        del infos['category_key']
+    if stored is not None and dict(stored) == infos:
+        stats.increment('categorized_elements_writes_skipped')
+        return False
+    key = None
+    if sort_key is not None:
+        try:
+            key = sort_key(infos)
+        except KeyError:
+            pass
+    storage.add(uid, infos, key=key)
+    return True
+
+
+def _join_category_infos(infos, snapshot):
+    """Return a ReadOnlyInfos of p_infos, category informations are added
+       if p_infos are normalized"""
+    category_infos = None
+    category_key = infos.get('category_key')
+    if category_key is not None and snapshot is not None:
+        category_infos = snapshot.get(category_key)
+    # _basic_infos is not copied as it is only read
+    return ReadOnlyInfos(
+        infos, category_infos is not None and category_infos._basic_infos or None)
+
+
+def get_categorized_elements_items(context, uids=None):
+    """Return a list of (uid, infos) of the categorized elements of
+       the given context (only p_uids if given), infos are ReadOnlyInfos
+       including category informations, nothing is copied"""
+    categorized_elements = getattr(aq_base(context), 'categorized_elements', {})
+    if not categorized_elements:
+        return []
+    if uids is None:
+        items = categorized_elements.items()
+    else:
+        if isinstance(categorized_elements, CategorizedElements):
+            uids = categorized_elements.ordered(uids)
+        else:
+            uids = set(uids)
+            uids = [uid for uid in categorized_elements.keys() if uid in uids]
+        items = [(uid, categorized_elements[uid]) for uid in uids]
+    snapshot = get_categories_snapshot(context)
+    return [(uid, _join_category_infos(infos, snapshot)) for uid, infos in items]
+
+
+def search_categorized_elements(context, **query):
+    """Return the set of UIDs of categorized elements of the given context
+       matching p_query, see storage.INDEXES for available indexes"""
+    categorized_elements = getattr(aq_base(context), 'categorized_elements', {})
+    if isinstance(categorized_elements, CategorizedElements):
+        return categorized_elements.search(**query)
+    return set([uid for uid, infos in categorized_elements.items()
+                if all([infos.get(name) == value for name, value in query.items()])])
+
+
+def get_categorized_element_infos(context, uid, default=None):
+    """Return a copy of the infos of categorized element p_uid of
+       the given context, including category informations"""
+    categorized_elements = getattr(aq_base(context), 'categorized_elements', {})
+    infos = categorized_elements.get(uid)
+    if infos is None:
+        return default
+    return _join_category_infos(infos, get_categories_snapshot(context)).copy()
+
+
 def _categorized_elements(context):
-    """Return a deepcopy of the categorized elements of the given context"""
-    return copy.deepcopy(
-        getattr(aq_base(context), 'categorized_elements', OrderedDict())
-    )
+    """Return a deepcopy of the categorized elements of the given context,
+       prefer get_categorized_elements_items that does not copy anything"""
+    return OrderedDict(
+        [(uid, infos.copy()) for uid, infos in get_categorized_elements_items(context)])
 
 
 def get_categorized_elements(context,
@@ -274,31 +597,37 @@ def get_categorized_elements(context,
        - 'dict': default, essential metadata are returned as a dict;
        - 'objects': categorized objects are returned."""
     elements = []
-    categorized_elements = _categorized_elements(context)
+    uids = uids and set(uids) or None
+    if portal_type:
+        found = search_categorized_elements(context, portal_type=portal_type)
+        uids = found if uids is None else uids & found
+    # infos are not copied, only returned ones
+    categorized_elements = get_categorized_elements_items(context, uids=uids)
     if not categorized_elements:
         return elements
 
-    uids = uids or categorized_elements.keys()
-    catalog = api.portal.get_tool('portal_catalog')
-    current_user_allowedRolesAndUsers = catalog._listAllowedRolesAndUsers(api.user.get_current())
-    for uid, infos in categorized_elements.items():
-        if uids and uid not in uids or \
-           portal_type and infos['portal_type'] != portal_type or \
-           (infos['confidential'] and
-                not set(infos['allowedRolesAndUsers']).intersection(current_user_allowedRolesAndUsers)):
+    user_tokens = get_current_user_tokens()
+    # decide if elements may be viewed from stored infos, without loading them
+    view_filter = getMultiAdapter((context, context.REQUEST), IIconifiedContentFilter)
+    for uid, infos in categorized_elements:
+        if infos['confidential'] and user_tokens.isdisjoint(infos['allowedRolesAndUsers']):
             continue
-        obj = context.get(infos['id'])
-        obj_uid = obj.UID()
-        adapter = getMultiAdapter(
-            (obj.aq_parent, obj.REQUEST, obj),
-            IIconifiedContent)
-        if adapter.can_view():
+        can_view = obj = None
+        if view_filter.use_fast_path:
+            can_view = view_filter.can_view(uid, infos)
+        if can_view is None:
+            obj = context.get(infos['id'])
+            adapter = getMultiAdapter(
+                (obj.aq_parent, obj.REQUEST, obj),
+                IIconifiedContent)
+            can_view = adapter.can_view()
+        if can_view:
             if result_type == 'objects':
-                elements.append(obj)
+                elements.append(obj or context.get(infos['id']))
             else:
                 # add 'UID' to the available infos
-                tmp = categorized_elements[obj_uid].copy()
-                tmp['UID'] = obj_uid
+                tmp = infos.copy()
+                tmp['UID'] = uid
                 elements.append(tmp)
 
     if elements and sort_on:
@@ -306,35 +635,121 @@ def get_categorized_elements(context,
             if sort_on in elements[0]:
                 elements = sorted(elements, key=lambda x, sort_on=sort_on: x[sort_on])
             elif sort_on == 'getObjPositionInParent':
-                elements = sorted(
-                    elements,
-                    key=lambda x, object_ids=context.objectIds(): object_ids.index(x['id']))
+                positions = get_positions_in_parent(context, [x['id'] for x in elements])
+                elements = sorted(elements, key=lambda x: positions[x['id']])
         else:
             if getattr(elements[0], sort_on):
                 elements = sorted(elements, key=lambda x, sort_on=sort_on: getattr(x, sort_on))
             elif sort_on == 'getObjPositionInParent':
-                elements = sorted(
-                    elements,
-                    key=lambda x, object_ids=context.objectIds(): object_ids.index(x.id))
+                positions = get_positions_in_parent(context, [x.getId() for x in elements])
+                elements = sorted(elements, key=lambda x: positions[x.getId()])
     return elements
 
 
+def get_positions_in_parent(context, ids):
+    """Return the position of every id of p_ids in p_context, by id.
+       Positions are read from the plone.folder ordering when available,
+       else from a map of the ids of p_context built once."""
+    ordering = getattr(aq_base(context), 'getOrdering', None)
+    if ordering is not None:
+        ordering = context.getOrdering()
+        positions = dict([(id, ordering.getObjectPosition(id)) for id in ids])
+        if None not in positions.values():
+            return positions
+    positions = dict([(id, idx) for idx, id in enumerate(context.objectIds())])
+    return dict([(id, positions[id]) for id in ids])
+
+
+def get_current_user_tokens():
+    """Return the allowedRolesAndUsers tokens of the current user as a
+       frozenset, computed once by request and user"""
+    user = api.user.get_current()
+    tokens_cache = cache.get_cache('user_tokens')
+    user_id = user.getId()
+    tokens = tokens_cache.get(user_id)
+    if tokens is None:
+        catalog = api.portal.get_tool('portal_catalog')
+        tokens = tokens_cache[user_id] = frozenset(
+            catalog._listAllowedRolesAndUsers(user))
+    return tokens
+
+
+def update_categorized_elements_security(container, uids=None):
+    """Update the allowedRolesAndUsers and modifyRolesAndUsers stored for
+       categorized elements of p_container (every elements if p_uids is None)"""
+    if not getattr(aq_base(container), 'categorized_elements', None):
+        return
+    storage = get_categorized_elements_storage(container)
+    for uid in uids or storage.keys():
+        infos = storage.get(uid)
+        obj = infos is not None and container.get(infos['id']) or None
+        if obj is None:
+            continue
+        adapter = getAdapter(obj, IIconifiedInfos)
+        for key, value in (('allowedRolesAndUsers', adapter._allowedRolesAndUsers),
+                           ('modifyRolesAndUsers', adapter._modifyRolesAndUsers)):
+            if infos.get(key) != value:
+                infos[key] = value
+
+
 def get_back_references(obj):
     catalog = api.portal.get_tool('portal_catalog')
     brains = catalog(content_category_uid=obj.UID())
     return brains
 
 
-def has_relations(obj):
-    for relation in get_back_references(obj):
-        return True
+def _category_uids(obj):
+    """UIDs of p_obj and of its subcategories if it is a category"""
+    uids = [obj.UID()]
     if ICategory.providedBy(obj):
-        for subcategory in obj.listFolderContents():
-            for relation in get_back_references(subcategory):
-                return True
+        snapshot = get_categories_snapshot(obj)
+        if snapshot is not None and obj.UID() in snapshot:
+            uids.extend([infos.uid for infos in
+                         snapshot.subcategories(obj.UID(), only_enabled=False)])
+        else:
+            uids.extend([subcategory.UID() for subcategory in obj.listFolderContents()])
+    return uids
+
+
+def count_relations(uids):
+    """Return the number of elements using every category or subcategory
+       of p_uids, read from the content_category_uid index so no query is
+       done, no brain is created and security is not checked"""
+    catalog = api.portal.get_tool('portal_catalog')
+    index = catalog._catalog.getIndex('content_category_uid')
+    counts = {}
+    for uid in uids:
+        rids = index._index.get(uid)
+        if rids is None:
+            counts[uid] = 0
+        elif isinstance(rids, int):
+            # single element
+            counts[uid] = 1
+        else:
+            counts[uid] = len(rids)
+    return counts
+
+
+def has_relations(obj):
+    """Is category or subcategory p_obj (or one of its subcategories)
+       used by an element?"""
+    catalog = api.portal.get_tool('portal_catalog')
+    index = catalog._catalog.getIndex('content_category_uid')
+    for uid in _category_uids(obj):
+        if index._index.get(uid) is not None:
+            return True
     return False
 
 
+def get_categories_usage(context):
+    """Return the number of elements using every category and subcategory
+       of the configuration of p_context, by UID"""
+    snapshot = get_categories_snapshot(context)
+    if snapshot is None:
+        return {}
+    return count_relations(snapshot.uids())
+
+
 def calculate_filesize(size):
     unit = 'B'
     factor = 1
@@ -356,10 +771,7 @@ def calculate_filesize(size):
 
 
 def warn_filesize(size):
-    filesizelimit = api.portal.get_registry_record(
-        'filesizelimit',
-        interface=IIconifiedCategorySettings,
-    )
+    filesizelimit = get_settings().filesizelimit
     if size > filesizelimit:
         return True
     return False
@@ -8,6 +8,7 @@ Created by mpeeters
 """
 
 from plone import api
+from Products.CMFPlone.utils import base_hasattr
 from zope.schema.vocabulary import SimpleVocabulary
 
 from collective.iconifiedcategory import utils
@@ -17,19 +18,21 @@ class CategoryVocabulary(object):
 
     def _get_categories(self, context):
         """Return categories to display in the vocabulary.
-           This needs to return a list of category objects."""
-        categories = utils.get_categories(context, the_objects=True)
+           This needs to return a list of category objects or CategoryInfos."""
+        categories = utils.get_categories_infos(context)
         return categories
 
     def _get_subcategories(self, context, category):
         """Return subcategories for given category.
-           This needs to return a list of subcategory brains."""
-        subcategories = api.content.find(
-            context=category,
-            object_provides='collective.iconifiedcategory.content.subcategory.ISubcategory',
-            enabled=True,
-        )
-        return subcategories
+           This needs to return a list of subcategory brains or CategoryInfos.
+           Subcategories the current user may not view are not returned."""
+        subcategories = utils.get_subcategories_infos(context, category)
+        if not subcategories:
+            return subcategories
+        # the catalog query filters subcategories on the View permission
+        viewable = set([brain.UID for brain in api.content.find(
+            UID=[infos.uid for infos in subcategories])])
+        return [infos for infos in subcategories if infos.uid in viewable]
 
     def __call__(self, context, use_category_uid_as_token=False):
         terms = []
@@ -49,7 +52,8 @@ class CategoryVocabulary(object):
             ))
             subcategories = self._get_subcategories(context, category)
             for subcategory in subcategories:
-                subcategory = subcategory.getObject()
+                if base_hasattr(subcategory, 'getObject'):
+                    subcategory = subcategory.getObject()
                 if use_category_uid_as_token:
                     subcategory_id = subcategory.UID()
                 else:
@@ -80,7 +84,8 @@ class CategoryTitleVocabulary(CategoryVocabulary):
                 ))
             subcategories = self._get_subcategories(context, category)
             for subcategory in subcategories:
-                subcategory = subcategory.getObject()
+                if base_hasattr(subcategory, 'getObject'):
+                    subcategory = subcategory.getObject()
                 subcategory_id = utils.calculate_category_id(subcategory)
                 if subcategory.predefined_title:
                     terms.append(SimpleVocabulary.createTerm(